@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Benchmarks for wtfpeewee form generation, instantiation, rendering,
+validation and population, run against a local SQLite fixture.
+
+    python benchmarks.py --rows 10,1000,100000 --output results.json
+    python benchmarks.py --output new.json --compare results.json
+
+Each benchmark records the best and mean wall time per call and the number of
+queries issued per call. Results are written as JSON so runs can be compared.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import peewee
+import wtforms
+from peewee import *
+from wtforms.form import Form
+
+from wtfpeewee.fields import ModelSelectField
+from wtfpeewee.fields import SelectMultipleQueryField
+from wtfpeewee.fields import SelectQueryField
+from wtfpeewee.orm import model_form
+
+
+database_proxy = Proxy()
+
+
+class BaseModel(Model):
+    class Meta:
+        database = database_proxy
+
+
+class Category(BaseModel):
+    name = CharField()
+
+    def __str__(self):
+        return self.name
+    __unicode__ = __str__
+
+
+class Item(BaseModel):
+    title = CharField()
+    description = TextField(null=True)
+    category = ForeignKeyField(Category)
+    price = DecimalField(default=0)
+    quantity = IntegerField(default=0)
+    created = DateTimeField(default=datetime.datetime.now)
+    published = BooleanField(default=False)
+
+
+class FakePost(dict):
+    def getlist(self, key):
+        val = self[key]
+        if isinstance(val, list):
+            return val
+        return [val]
+
+
+class QueryCounter(object):
+    def __init__(self, database):
+        self.database = database
+        self.count = 0
+
+    def __enter__(self):
+        original = self.database.execute_sql
+        def execute_sql(*args, **kwargs):
+            self.count += 1
+            return original(*args, **kwargs)
+        self.database.execute_sql = execute_sql
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        del self.database.execute_sql
+
+
+def build_fixture(database, rows):
+    """Ensure the Category table holds exactly `rows` rows."""
+    database_proxy.initialize(database)
+    database.create_tables([Category, Item], safe=True)
+    if Category.select().count() == rows:
+        return
+    with database.atomic():
+        Category.delete().execute()
+        batch = []
+        for i in range(rows):
+            batch.append({'name': 'category %07d' % i})
+            if len(batch) == 300:
+                Category.insert_many(batch).execute()
+                batch = []
+        if batch:
+            Category.insert_many(batch).execute()
+
+
+def measure(name, fn, database, repeat, rows=None):
+    # Warm up once, which also catches errors before timing.
+    fn()
+    timings = []
+    with QueryCounter(database) as counter:
+        for _ in range(repeat):
+            start = time.time()
+            fn()
+            timings.append(time.time() - start)
+    result = {
+        'name': name,
+        'rows': rows,
+        'calls': repeat,
+        'best': min(timings),
+        'mean': sum(timings) / len(timings),
+        'queries': float(counter.count) / repeat,
+    }
+    print('%-40s %10s %12.6fs %12.6fs %8.1f' % (
+        name, rows if rows is not None else '-', result['best'],
+        result['mean'], result['queries']))
+    return result
+
+
+def form_benchmarks(database, repeat):
+    category = Category.select().get()
+    item = Item(title='title', category=category, price=1, quantity=2)
+    ItemForm = model_form(Item)
+    CompiledItemForm = model_form(Item, compiled=True)
+    LazyItemForm = model_form(Item, lazy=True)
+    post = FakePost({
+        'title': 'new item',
+        'description': 'description',
+        'category': str(category.get_id()),
+        'price': '10.00',
+        'quantity': '3',
+        'created-date': '2011-02-01',
+        'created-time': '12:00:00',
+        'published': 'y',
+    })
+
+    def populate():
+        form = ItemForm(post)
+        form.validate()
+        form.populate_obj(Item())
+
+    return [
+        measure('model_form', lambda: model_form(Item), database, repeat),
+        measure('model_form_cached',
+                lambda: model_form(Item, cache=True), database, repeat),
+        measure('instantiate', ItemForm, database, repeat),
+        measure('instantiate_obj', lambda: ItemForm(obj=item), database, repeat),
+        measure('instantiate_compiled', CompiledItemForm, database, repeat),
+        measure('instantiate_lazy', LazyItemForm, database, repeat),
+        measure('validate', lambda: ItemForm(post).validate(), database, repeat),
+        measure('validate_compiled',
+                lambda: CompiledItemForm(post).validate(), database, repeat),
+        measure('populate_obj', populate, database, repeat),
+    ]
+
+
+def render_benchmarks(database, rows, repeat):
+    selected = Category.select().order_by(Category.id.desc()).get()
+
+    class SelectForm(Form):
+        query_field = SelectQueryField(query=Category.select())
+        model_field = ModelSelectField(model=Category)
+        multiple_field = SelectMultipleQueryField(query=Category.select())
+
+    form = SelectForm(FakePost({
+        'query_field': str(selected.get_id()),
+        'model_field': str(selected.get_id()),
+        'multiple_field': [str(selected.get_id())],
+    }))
+    return [
+        measure('render_select_query_field', form.query_field, database,
+                repeat, rows),
+        measure('render_model_select_field', form.model_field, database,
+                repeat, rows),
+        measure('render_select_multiple_query_field', form.multiple_field,
+                database, repeat, rows),
+    ]
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as fh:
+        baseline = json.load(fh)
+    previous = dict(
+        ((r['name'], r['rows']), r) for r in baseline['results'])
+    print('')
+    print('%-40s %10s %12s %12s %8s' % (
+        'benchmark', 'rows', 'before', 'after', 'ratio'))
+    for result in results:
+        old = previous.get((result['name'], result['rows']))
+        if old is None:
+            continue
+        print('%-40s %10s %12.6f %12.6f %7.2fx' % (
+            result['name'], result['rows'] if result['rows'] is not None else '-',
+            old['best'], result['best'],
+            old['best'] / result['best'] if result['best'] else 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', default='10,1000,10000',
+                        help='comma-separated fixture sizes for render benchmarks')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='calls per benchmark (render benchmarks on large '
+                             'fixtures are capped)')
+    parser.add_argument('--database', default=None,
+                        help='SQLite file to use (default: a temporary file)')
+    parser.add_argument('--output', default=None,
+                        help='write JSON results to this file')
+    parser.add_argument('--compare', default=None,
+                        help='JSON results from a previous run to compare with')
+    options = parser.parse_args(argv)
+
+    path = options.database
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+    database = SqliteDatabase(path)
+
+    sizes = [int(size) for size in options.rows.split(',') if size]
+    print('%-40s %10s %13s %13s %8s' % (
+        'benchmark', 'rows', 'best', 'mean', 'queries'))
+
+    results = []
+    for i, rows in enumerate(sizes):
+        build_fixture(database, rows)
+        if i == 0:
+            results.extend(form_benchmarks(database, options.repeat))
+        repeat = max(1, min(options.repeat, 100000 // max(rows, 1)))
+        results.extend(render_benchmarks(database, rows, repeat))
+
+    database.close()
+    if options.database is None:
+        os.unlink(path)
+
+    output = {
+        'meta': {
+            'python': platform.python_version(),
+            'peewee': peewee.__version__,
+            'wtforms': wtforms.__version__,
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'argv': sys.argv[1:],
+        },
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as fh:
+            json.dump(output, fh, indent=2, sort_keys=True)
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,26 @@
 import sys
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
 
 PY2 = sys.version_info[0] == 2
 
 if PY2:
     text_type = unicode
     string_types = (str, unicode)
+    integer_types = (int, long)
     unichr = unichr
     reduce = reduce
+    from collections import MutableMapping
+    from cgi import escape
 else:
     text_type = str
     string_types = (str,)
+    integer_types = (int,)
     unichr = chr
     from functools import reduce
+    from collections.abc import MutableMapping
+    from html import escape
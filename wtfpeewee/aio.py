@@ -0,0 +1,162 @@
+"""
+Asyncio counterparts of the lookups made by query-backed fields (Python 3.5+).
+
+Queries are run through an adapter: any object with a coroutine method
+``execute(query)`` returning the rows of a peewee ``SELECT``, for example a
+peewee-async ``Manager``. `SyncAdapter` runs queries with the regular peewee
+API and can stand in for a real async driver in tests.
+
+    class PostForm(AsyncForm, model_form(Post)):
+        pass
+
+    form = PostForm(formdata)
+    await form.preload_choices(manager)
+    if await form.validate_async(manager):
+        ...
+
+Every query-backed field of the form is resolved before validating, with the
+queries for distinct models and queries running concurrently, so the
+validators and ``pre_validate`` methods do not block.
+"""
+import asyncio
+
+from wtforms.form import Form
+
+from wtfpeewee.cache import current_identity_map
+from wtfpeewee.cache import instances_by_pk
+from wtfpeewee.cache import lookup_query
+from wtfpeewee.forms import pending_query_groups
+
+
+__all__ = (
+    'AsyncForm',
+    'SyncAdapter',
+    'load_instances_async',
+    'preload_choices_async',
+    'resolve_query_fields_async',
+    'validate_async',
+)
+
+
+class SyncAdapter(object):
+    """
+    Runs queries with the blocking peewee API, in `executor` if one is given
+    (see ``loop.run_in_executor``) or directly on the event loop otherwise.
+    Each query yields to the event loop first, so concurrent lookups are
+    interleaved. `peak` records the largest number of queries in flight.
+    """
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.active = 0
+        self.peak = 0
+
+    def run(self, query):
+        return list(query.clone())
+
+    async def execute(self, query):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0)
+            if self.executor is None:
+                return self.run(query)
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, self.run, query)
+        finally:
+            self.active -= 1
+
+
+async def load_instances_async(adapter, query, pks):
+    """
+    Asynchronous version of ``wtfpeewee.cache.load_instances``, which also
+    goes through the active `IdentityMap` if there is one.
+    """
+    identity_map = current_identity_map()
+    if identity_map is None:
+        if not pks:
+            return instances_by_pk(())
+        return instances_by_pk(await adapter.execute(lookup_query(query, pks)))
+
+    missing = identity_map.missing(query, pks)
+    if missing:
+        rows = await adapter.execute(lookup_query(query, missing))
+        identity_map.update(query, missing, instances_by_pk(rows))
+    return identity_map.collect(query, pks)
+
+
+async def _existing_pks(adapter, query, pks):
+    pk_field = query.model_class._meta.primary_key
+    lookup = lookup_query(query, pks).select(pk_field).tuples()
+    return set(row[0] for row in await adapter.execute(lookup))
+
+
+async def _resolve_group(adapter, query, members):
+    all_pks = set()
+    for field, pks in members:
+        all_pks.update(pks)
+    instances = await load_instances_async(adapter, query, list(all_pks))
+    for field, pks in members:
+        field.resolve_pending(instances)
+
+
+async def _verify_group(adapter, query, members):
+    all_pks = set()
+    for field, pks in members:
+        all_pks.update(pks)
+    existing = await _existing_pks(adapter, query, list(all_pks))
+    for field, pks in members:
+        field.mark_verified(existing)
+
+
+async def resolve_query_fields_async(form, adapter):
+    """
+    Load the submitted values of all query-backed fields on `form` and check
+    that any other current values are selected by their field's query, with
+    one query per distinct query, all running concurrently.
+    """
+    tasks = []
+    for query, members in pending_query_groups(form):
+        tasks.append(_resolve_group(adapter, query, members))
+    for query, members in pending_query_groups(form, 'unverified_pks'):
+        tasks.append(_verify_group(adapter, query, members))
+    await asyncio.gather(*tasks)
+
+
+async def preload_choices_async(form, adapter):
+    """
+    Load the choices of every query-backed select field on `form`
+    concurrently, so rendering them does not query.
+    """
+    fields = [field for field in form
+              if getattr(field, 'preload_choices', None) is not None]
+    results = await asyncio.gather(*[
+        adapter.execute(field.choice_query()) for field in fields])
+    for field, rows in zip(fields, results):
+        field.preload_choices(rows)
+
+
+async def validate_async(form, adapter):
+    """Resolve the query-backed fields of `form`, then validate it."""
+    await resolve_query_fields_async(form, adapter)
+    return form.validate()
+
+
+class AsyncForm(Form):
+    """
+    Form mixin providing `validate_async` and `preload_choices`. The adapter
+    may be passed to each call or set as the `adapter` class attribute.
+    """
+    adapter = None
+
+    def _get_adapter(self, adapter):
+        if adapter is None:
+            adapter = self.adapter
+        if adapter is None:
+            raise ValueError('No async adapter was given.')
+        return adapter
+
+    async def validate_async(self, adapter=None):
+        return await validate_async(self, self._get_adapter(adapter))
+
+    async def preload_choices(self, adapter=None):
+        await preload_choices_async(self, self._get_adapter(adapter))
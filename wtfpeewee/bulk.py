@@ -0,0 +1,171 @@
+"""
+Persist many validated model forms with a handful of queries.
+"""
+from peewee import Clause
+from peewee import MySQLDatabase
+from peewee import Param
+from peewee import PostgresqlDatabase
+from peewee import SQL
+from peewee import SqliteDatabase
+
+
+__all__ = (
+    'PARAMETER_LIMITS',
+    'bulk_save',
+    'chunk_size_for',
+)
+
+# Maximum number of bound parameters per statement for each backend. SQLite's
+# compile-time default (SQLITE_MAX_VARIABLE_NUMBER) was 999 prior to 3.32.
+PARAMETER_LIMITS = (
+    (SqliteDatabase, 999),
+    (PostgresqlDatabase, 32767),
+    (MySQLDatabase, 65535),
+)
+DEFAULT_PARAMETER_LIMIT = 999
+
+
+def chunk_size_for(database, params_per_row, reserved=0):
+    """
+    Return how many rows fit in a single statement on `database`, given the
+    number of parameters each row requires.
+    """
+    limit = DEFAULT_PARAMETER_LIMIT
+    for database_class, max_params in PARAMETER_LIMITS:
+        if isinstance(database, database_class):
+            limit = max_params
+            break
+    return max(1, (limit - reserved) // max(1, params_per_row))
+
+
+def _chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _hashable(values):
+    try:
+        hash(values)
+    except TypeError:
+        return False
+    return True
+
+
+def _insert_rows(model, database, instances):
+    pk_field = model._meta.primary_key
+    groups = {}
+    for instance in instances:
+        row = dict(instance._data)
+        if row.get(pk_field.name) is None:
+            row.pop(pk_field.name, None)
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    for columns, rows in groups.items():
+        size = chunk_size_for(database, len(columns))
+        for chunk in _chunked(rows, size):
+            model.insert_many(chunk).execute()
+
+
+def _case(pk_field, field, rows):
+    nodes = [SQL('CASE'), pk_field.as_entity(with_table=False)]
+    for pk_value, value in rows:
+        nodes.extend((
+            SQL('WHEN'), Param(pk_field.db_value(pk_value)),
+            SQL('THEN'), Param(field.db_value(value))))
+    nodes.extend((SQL('ELSE'), field.as_entity(with_table=False), SQL('END')))
+    return Clause(*nodes)
+
+
+def _update_rows(model, database, instances, fields):
+    pk_field = model._meta.primary_key
+    if not fields:
+        return
+
+    # Rows which write identical values are grouped into a single
+    # "UPDATE ... WHERE pk IN (...)", the rest are written using CASE.
+    groups = {}
+    distinct = []
+    for instance in instances:
+        pk_value = instance._get_pk_value()
+        values = tuple(instance._data.get(field.name) for field in fields)
+        if _hashable(values):
+            groups.setdefault(values, []).append(pk_value)
+        else:
+            distinct.append((pk_value, values))
+
+    for values, pks in groups.items():
+        if len(pks) == 1:
+            distinct.append((pks[0], values))
+            continue
+        update = dict(zip(fields, values))
+        size = chunk_size_for(database, 1, reserved=len(fields))
+        for chunk in _chunked(pks, size):
+            model.update(dict(update)).where(pk_field << chunk).execute()
+
+    size = chunk_size_for(database, 2 * len(fields) + 1)
+    for chunk in _chunked(distinct, size):
+        update = {}
+        for i, field in enumerate(fields):
+            update[field] = _case(
+                pk_field,
+                field,
+                [(pk_value, values[i]) for pk_value, values in chunk])
+        pks = [pk_value for pk_value, _ in chunk]
+        model.update(update).where(pk_field << pks).execute()
+
+
+def bulk_save(model, forms, instances=None):
+    """
+    Populate and save a list of validated forms for `model` inside a single
+    transaction.
+
+    :param model:
+        The peewee model class the forms were generated for.
+    :param forms:
+        A list of form instances which have already been validated.
+    :param instances:
+        An optional list, parallel to `forms`, of the model instances being
+        edited. A `None` entry (or omitting the list entirely) creates a new
+        row for the corresponding form.
+
+    New rows are written using ``insert_many`` and existing rows using grouped
+    or CASE-based UPDATEs, in chunks sized to the backend's parameter limit.
+    Only the columns present on the forms are updated. Note that primary keys
+    are not assigned to newly-inserted instances.
+
+    Returns the list of populated model instances.
+    """
+    if instances is None:
+        instances = [None] * len(forms)
+    elif len(instances) != len(forms):
+        raise ValueError('forms and instances must be the same length.')
+
+    new_rows = []
+    existing = []
+    populated = []
+    field_names = set()
+    for form, instance in zip(forms, instances):
+        if instance is None:
+            instance = model()
+            new_rows.append(instance)
+        else:
+            existing.append(instance)
+        form.populate_obj(instance)
+        populated.append(instance)
+        field_names.update(form._fields)
+
+    pk_field = model._meta.primary_key
+    fields = [field for field in model._meta.sorted_fields
+              if field.name in field_names and field is not pk_field]
+
+    database = model._meta.database
+    with database.atomic():
+        if new_rows:
+            _insert_rows(model, database, new_rows)
+        if existing:
+            _update_rows(model, database, existing, fields)
+            for instance in existing:
+                if hasattr(instance, '_dirty'):
+                    instance._dirty.clear()
+
+    return populated
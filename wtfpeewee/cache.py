@@ -0,0 +1,344 @@
+"""
+Caches shared between fields and requests.
+"""
+import threading
+import time
+
+from peewee import Field
+
+from wtfpeewee._compat import OrderedDict
+from wtfpeewee.choices import CompactChoices
+
+
+__all__ = (
+    'ChoiceCache',
+    'FragmentCache',
+    'IdentityMap',
+    'choice_cache',
+    'current_identity_map',
+    'fragment_cache',
+    'load_instances',
+)
+
+_local = threading.local()
+
+
+class ChoiceCache(object):
+    """
+    A TTL and size-bounded cache of ``(pk, label)`` pairs for query-backed
+    select fields, keyed by the compiled SQL and parameters of the choice
+    query along with the label getter.
+
+    Pass an instance (or ``True`` to use the shared `choice_cache`) as the
+    ``choice_cache`` argument of `SelectQueryField` or `ModelSelectField`.
+    Entries can be dropped per model with `invalidate`, and `connect_signals`
+    will do so automatically when instances of models using
+    ``playhouse.signals`` are saved or deleted.
+
+    If `compact` is `True`, choice lists with integer primary keys are stored
+    as `wtfpeewee.choices.CompactChoices`, which take a fraction of the memory
+    and let fields validate submitted pks without querying.
+    """
+    def __init__(self, ttl=300, max_size=256, clock=time.time, compact=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.compact = compact
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def make_key(self, query, label_key=None):
+        sql, params = query.sql()
+        return (query.database, sql, tuple(params), label_key)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, model, choices = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires is not None and expires <= self.clock():
+                return None
+            self._entries[key] = (expires, model, choices)
+            return choices
+
+    def set(self, key, model, choices):
+        expires = self.clock() + self.ttl if self.ttl else None
+        choices = tuple(choices)
+        if self.compact:
+            choices = CompactChoices.from_pairs(choices) or choices
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, model, choices)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_choices(self, query, load_choices, label_key=None):
+        """
+        Return the cached ``(pk, label)`` pairs for `query`, calling
+        `load_choices` to produce them if they are missing or expired.
+        """
+        key = self.make_key(query, label_key)
+        choices = self.get(key)
+        if choices is None:
+            choices = tuple(load_choices())
+            self.set(key, query.model_class, choices)
+            choices = self.get(key) or choices
+        return choices
+
+    def invalidate(self, model):
+        """Drop every cached choice list built from a query on `model`."""
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v[1] is model]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def connect_signals(self, sender=None):
+        """
+        Invalidate cached choices whenever an instance of a
+        ``playhouse.signals.Model`` subclass (optionally limited to `sender`)
+        is saved or deleted.
+        """
+        from playhouse.signals import post_delete
+        from playhouse.signals import post_save
+
+        def invalidate(model_class, instance, *args, **kwargs):
+            self.invalidate(model_class)
+
+        name = self._receiver_name(sender)
+        post_save.connect(invalidate, name=name, sender=sender)
+        post_delete.connect(invalidate, name=name, sender=sender)
+
+    def disconnect_signals(self, sender=None):
+        """Undo a call to `connect_signals` with the same `sender`."""
+        from playhouse.signals import post_delete
+        from playhouse.signals import post_save
+
+        name = self._receiver_name(sender)
+        post_save.disconnect(name=name)
+        post_delete.disconnect(name=name)
+
+    def _receiver_name(self, sender):
+        # One receiver per cache and sender, so a cache can follow several.
+        return 'wtfpeewee_choice_cache_%s_%s' % (
+            id(self), 'all' if sender is None else id(sender))
+
+
+choice_cache = ChoiceCache()
+
+
+class FragmentCache(object):
+    """
+    A size-bounded cache of rendered HTML fragments. Each fragment is stored
+    along with the version of the data it was rendered from (for select
+    widgets, the choice tuple held by a `ChoiceCache`) and is only returned
+    while that version is current.
+    """
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        with self._lock:
+            try:
+                entry_version, fragment = self._entries.pop(key)
+            except KeyError:
+                return None
+            if entry_version is not version:
+                return None
+            self._entries[key] = (entry_version, fragment)
+            return fragment
+
+    def set(self, key, version, fragment):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, fragment)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+def _query_key(query):
+    sql, params = query.sql()
+    return (query.database, sql, tuple(params))
+
+
+def _full_rows(query):
+    # Whether the query loads every column of its model, and nothing else, so
+    # its instances can stand in for those of any other such query.
+    model = query.model_class
+    names = set()
+    for node in query._select:
+        if (not isinstance(node, Field) or node.model_class is not model or
+                node._alias is not None):
+            return False
+        names.add(node.name)
+    return names == set(model._meta.fields)
+
+
+def _unrestricted(query):
+    # Any row of the model is a member of a bare "SELECT ... FROM model".
+    return (query._where is None and not any(query._joins.values()) and
+            query._having is None and query._limit is None and
+            not query._offset and _full_rows(query))
+
+
+def lookup_query(query, pks):
+    """Return `query` restricted to the rows with the given primary keys."""
+    pk_field = query.model_class._meta.primary_key
+    if len(pks) == 1:
+        return query.clone().where(pk_field == pks[0])
+    return query.clone().where(pk_field << list(pks))
+
+
+def instances_by_pk(rows):
+    instances = OrderedDict()
+    for obj in rows:
+        instances[obj._get_pk_value()] = obj
+    return instances
+
+
+def _fetch(query, pks):
+    if not pks:
+        return OrderedDict()
+    return instances_by_pk(lookup_query(query, pks))
+
+
+class IdentityMap(object):
+    """
+    A request-scoped map of ``(model, pk)`` to model instance. While active,
+    query-backed fields look up submitted values here before querying, so a
+    given row is loaded at most once per request, across fields and forms.
+
+        with IdentityMap():
+            form = PostForm(request.form)
+            form.validate()
+
+    Instances are shared between fields whose query selects every column of
+    the model without any filtering. For other queries, the map remembers the
+    instances found (and the pks not found) by each distinct query, and only
+    instances with every column loaded are shared.
+
+    For frameworks with request hooks, call `activate` when the request starts
+    and `deactivate` when it ends. Maps are per-thread and may be nested.
+    """
+    def __init__(self):
+        self._instances = {}
+        self._members = {}
+
+    def __len__(self):
+        return len(self._instances)
+
+    def activate(self):
+        stack = getattr(_local, 'identity_maps', None)
+        if stack is None:
+            stack = _local.identity_maps = []
+        stack.append(self)
+        return self
+
+    def deactivate(self):
+        _local.identity_maps.remove(self)
+
+    __enter__ = activate
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.deactivate()
+
+    def get(self, model, pk):
+        return self._instances.get((model, pk))
+
+    def add(self, instance):
+        """
+        Register `instance`, returning the instance already held for the same
+        row if there is one.
+        """
+        key = (type(instance), instance._get_pk_value())
+        return self._instances.setdefault(key, instance)
+
+    def load(self, query, pks):
+        """
+        Return an ordered mapping of pk to instance for each of `pks` that is
+        selected by `query`, in the order given, querying only for rows which
+        have not been seen before.
+        """
+        missing = self.missing(query, pks)
+        if missing:
+            self.update(query, missing, _fetch(query, missing))
+        return self.collect(query, pks)
+
+    def missing(self, query, pks):
+        """Return those of `pks` which are not yet known for `query`."""
+        model = query.model_class
+        unrestricted = _unrestricted(query)
+        members = self._members.setdefault(_query_key(query), {})
+
+        missing = []
+        for pk in pks:
+            if pk in members:
+                continue
+            elif unrestricted and (model, pk) in self._instances:
+                members[pk] = self._instances[(model, pk)]
+            else:
+                missing.append(pk)
+        return missing
+
+    def update(self, query, pks, fetched):
+        """
+        Record the result of looking up `pks` through `query`, where `fetched`
+        maps the pks which were found to their instances.
+        """
+        members = self._members.setdefault(_query_key(query), {})
+        full_rows = _full_rows(query)
+        for pk in pks:
+            obj = fetched.get(pk)
+            if obj is not None and full_rows:
+                obj = self.add(obj)
+            members[pk] = obj
+
+    def collect(self, query, pks):
+        members = self._members.get(_query_key(query), {})
+        instances = OrderedDict()
+        for pk in pks:
+            obj = members.get(pk)
+            if obj is not None:
+                instances[pk] = obj
+        return instances
+
+    def clear(self):
+        self._instances.clear()
+        self._members.clear()
+
+
+def current_identity_map():
+    """Return the innermost active `IdentityMap` for this thread, if any."""
+    stack = getattr(_local, 'identity_maps', None)
+    if stack:
+        return stack[-1]
+
+
+def load_instances(query, pks):
+    """
+    Return an ordered mapping of pk to instance for each of the (coerced)
+    `pks` selected by `query`, going through the active `IdentityMap` if there
+    is one.
+    """
+    identity_map = current_identity_map()
+    if identity_map is not None:
+        return identity_map.load(query, pks)
+    return _fetch(query, pks)
@@ -0,0 +1,104 @@
+"""
+Compact storage for large choice lists.
+"""
+from array import array
+from bisect import bisect_left
+
+from wtfpeewee._compat import integer_types, text_type
+
+
+__all__ = (
+    'CompactChoices',
+)
+
+
+def _typecode(codes, size):
+    for code in codes:
+        try:
+            if array(code).itemsize >= size:
+                return code
+        except ValueError:
+            pass
+
+# Python 2's array module has no 'q', fall back to a C long.
+PK_TYPECODE = _typecode('ql', 8)
+OFFSET_TYPECODE = _typecode('IL', 4)
+INDEX_TYPECODE = OFFSET_TYPECODE
+_bits = 8 * array(PK_TYPECODE).itemsize
+PK_RANGE = (-2 ** (_bits - 1), 2 ** (_bits - 1) - 1)
+
+
+class CompactChoices(object):
+    """
+    An immutable sequence of ``(pk, label)`` pairs with integer primary keys,
+    stored as an array of pks, a single UTF-8 buffer of labels with an array
+    of offsets, and a sorted index of the pks for ``O(log n)`` lookups.
+
+    Build instances with `from_pairs`, or pass ``compact=True`` to
+    `ChoiceCache` to have it store choice lists this way.
+    """
+    def __init__(self, pks, offsets, labels):
+        self._pks = pks
+        self._offsets = offsets
+        self._labels = labels
+        order = sorted(range(len(pks)), key=pks.__getitem__)
+        self._order = array(INDEX_TYPECODE, order)
+        self._sorted = array(PK_TYPECODE, [pks[i] for i in order])
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Build a `CompactChoices` from ``(pk, label)`` pairs, or return `None`
+        if any primary key is not an integer which fits in the array.
+        """
+        pks = array(PK_TYPECODE)
+        offsets = array(OFFSET_TYPECODE, [0])
+        labels = []
+        position = 0
+        for pk, label in pairs:
+            if (not isinstance(pk, integer_types) or isinstance(pk, bool) or
+                    not PK_RANGE[0] <= pk <= PK_RANGE[1]):
+                return None
+            if not isinstance(label, text_type):
+                label = text_type(label)
+            label = label.encode('utf-8')
+            position += len(label)
+            pks.append(pk)
+            offsets.append(position)
+            labels.append(label)
+        return cls(pks, offsets, b''.join(labels))
+
+    def __len__(self):
+        return len(self._pks)
+
+    def label(self, i):
+        return self._labels[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self._pks)
+        return (self._pks[i], self.label(i))
+
+    def __iter__(self):
+        pks = self._pks
+        for i in range(len(pks)):
+            yield (pks[i], self.label(i))
+
+    def index_of(self, pk):
+        """Return the position of `pk`, or `None` if it is not a choice."""
+        try:
+            i = bisect_left(self._sorted, pk)
+        except TypeError:
+            return None
+        if i < len(self._sorted) and self._sorted[i] == pk:
+            return self._order[i]
+        return None
+
+    def has_pk(self, pk):
+        return self.index_of(pk) is not None
+
+    def label_for(self, pk):
+        """Return the label of `pk`, or `None` if it is not a choice."""
+        i = self.index_of(pk)
+        if i is not None:
+            return self.label(i)
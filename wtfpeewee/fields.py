@@ -2,24 +2,60 @@
 Useful form fields for use with the Peewee ORM.
 (cribbed from wtforms.ext.django.fields)
 """
+import base64
 import datetime
+import json
 import operator
+import re
+import threading
 import warnings
 
+from peewee import Model
 from wtforms import fields, form, widgets
 from wtforms.fields import FormField, _unset_value
 from wtforms.validators import ValidationError
 from wtforms.widgets import HTMLString, html_params
-from wtfpeewee._compat import text_type, string_types
+from wtfpeewee._compat import OrderedDict, escape, integer_types, reduce, text_type, string_types
+from wtfpeewee.cache import choice_cache as default_choice_cache
+from wtfpeewee.cache import fragment_cache as default_fragment_cache
+from wtfpeewee.cache import load_instances
 
 __all__ = (
     'ModelSelectField', 'ModelSelectMultipleField', 'ModelHiddenField',
+    'RemoteModelSelectField',
     'SelectQueryField', 'SelectMultipleQueryField', 'HiddenQueryField',
     'SelectChoicesField', 'BooleanSelectField', 'WPTimeField', 'WPDateField',
-    'WPDateTimeField',
+    'WPDateTimeField', 'FlatDateTimeField', 'ChosenSelectWidget',
+    'StreamingSelectWidget', 'CachedSelectWidget', 'RemoteSelectWidget',
 )
 
 
+def coerce_pk(model, value):
+    """
+    Convert `value` using the primary key field of `model`, returning `None`
+    if it cannot be converted.
+    """
+    try:
+        return model._meta.primary_key.python_value(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def iterate_rows(query):
+    """
+    Iterate over the results of `query` straight from the cursor, without
+    caching the rows on the query (the equivalent of ``query.iterator()``,
+    which raises under PEP 479 on Python 3.7+ with peewee 2.x).
+    """
+    result = query.clone().execute()
+    while True:
+        try:
+            obj = result.iterate()
+        except StopIteration:
+            return
+        yield obj
+
+
 class StaticAttributesMixin(object):
     attributes = {}
 
@@ -52,6 +88,15 @@ class BooleanSelectField(fields.SelectFieldBase):
                 raise ValueError(self.gettext(u'Invalid Choice: could not coerce'))
 
 
+# Stands in for a choice whose value cannot be coerced.
+_NO_CHOICE = object()
+
+# Input shapes which can be parsed without strptime, mirroring the patterns
+# strptime itself uses for these directives.
+_TIME_RE = re.compile(r'(2[0-3]|[0-1]\d|\d):([0-5]\d|\d)(?::([0-5]\d|\d))?\Z')
+_DATE_RE = re.compile(r'(\d\d\d\d)-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9])\Z')
+
+
 class WPTimeField(StaticAttributesMixin, fields.TextField):
     attributes = {'class': 'time-widget'}
     formats = ['%H:%M:%S', '%H:%M']
@@ -63,6 +108,15 @@ class WPTimeField(StaticAttributesMixin, fields.TextField):
             return self.data and self.data.strftime(self.formats[0]) or u''
 
     def convert(self, time_str):
+        # Detect "HH:MM[:SS]" input directly, only trying each format with
+        # strptime when the input has some other shape.
+        match = _TIME_RE.match(time_str)
+        if match is not None:
+            hour, minute, second = match.groups()
+            format = second is None and '%H:%M' or '%H:%M:%S'
+            if format in self.formats:
+                return datetime.time(int(hour), int(minute), int(second or 0))
+
         for format in self.formats:
             try:
                 return datetime.datetime.strptime(time_str, format).time()
@@ -79,6 +133,17 @@ class WPTimeField(StaticAttributesMixin, fields.TextField):
 class WPDateField(StaticAttributesMixin, fields.DateField):
     attributes = {'class': 'date-widget'}
 
+    def process_formdata(self, valuelist):
+        if valuelist and self.format == '%Y-%m-%d':
+            match = _DATE_RE.match(u' '.join(valuelist))
+            if match is not None:
+                try:
+                    self.data = datetime.date(*[int(part) for part in match.groups()])
+                    return
+                except ValueError:
+                    pass
+        super(WPDateField, self).process_formdata(valuelist)
+
 
 def datetime_widget(field, **kwargs):
     kwargs.setdefault('id', field.id)
@@ -90,13 +155,39 @@ def datetime_widget(field, **kwargs):
     return HTMLString(u''.join(html))
 
 
-def generate_datetime_form(validators=None):
+_datetime_forms = OrderedDict()
+_datetime_forms_lock = threading.Lock()
+DATETIME_FORM_CACHE_SIZE = 128
+
+
+def _build_datetime_form(validators):
     class _DateTimeForm(form.Form):
         date = WPDateField(validators=validators)
         time = WPTimeField(validators=validators)
     return _DateTimeForm
 
 
+def generate_datetime_form(validators=None):
+    """
+    Return the date/time subform class for `validators`. Classes are cached
+    by validator set, so fields sharing their validators share one class.
+    """
+    key = tuple(validators or ())
+    try:
+        hash(key)
+    except TypeError:
+        return _build_datetime_form(validators)
+
+    with _datetime_forms_lock:
+        form_class = _datetime_forms.pop(key, None)
+        if form_class is None:
+            form_class = _build_datetime_form(validators)
+        _datetime_forms[key] = form_class
+        while len(_datetime_forms) > DATETIME_FORM_CACHE_SIZE:
+            _datetime_forms.popitem(last=False)
+    return form_class
+
+
 class WPDateTimeField(FormField):
     widget = staticmethod(datetime_widget)
 
@@ -131,6 +222,89 @@ class WPDateTimeField(FormField):
             return datetime.datetime.combine(date_data, time_data)
 
 
+class FlatDateTimeField(fields.Field):
+    """
+    A lighter alternative to `WPDateTimeField` which renders and accepts the
+    same ``<name>-date`` and ``<name>-time`` inputs and exposes the same
+    `date` and `time` subfields, but binds them directly rather than
+    through a nested form. To use it for every datetime column, subclass
+    ``ModelConverter`` and map ``DateTimeField`` and ``TimestampField`` to it
+    in `defaults`.
+    """
+    widget = staticmethod(datetime_widget)
+
+    def __init__(self, label='', validators=None, separator='-', **kwargs):
+        super(FlatDateTimeField, self).__init__(label, **kwargs)
+        self.separator = separator
+        self.subfield_validators = validators
+        self._subfields = None
+
+    def bind_subfields(self):
+        """
+        Create the `date` and `time` subfields for the field's current name.
+        Called on every `process`, so each form instance gets its own.
+        """
+        prefix = self.name + self.separator
+        self._subfields = tuple(
+            field_class(
+                validators=self.subfield_validators, _form=None, _name=name,
+                _prefix=prefix, _meta=self.meta,
+                _translations=self._translations)
+            for field_class, name in ((WPDateField, 'date'), (WPTimeField, 'time')))
+
+    def _get_subfields(self):
+        if self._subfields is None:
+            self.bind_subfields()
+        return self._subfields
+
+    date = property(lambda self: self._get_subfields()[0])
+    time = property(lambda self: self._get_subfields()[1])
+
+    def __iter__(self):
+        return iter(self._get_subfields())
+
+    def __getitem__(self, name):
+        return {'date': self.date, 'time': self.time}[name]
+
+    def process(self, formdata, data=_unset_value):
+        self.bind_subfields()
+        if data is _unset_value:
+            try:
+                data = self.default()
+            except TypeError:
+                data = self.default
+        self.object_data = data
+
+        if data and data is not _unset_value:
+            self.date.process(formdata, data.date())
+            self.time.process(formdata, data.time())
+        else:
+            self.date.process(formdata)
+            self.time.process(formdata)
+
+    def validate(self, form, extra_validators=tuple()):
+        if extra_validators:
+            raise TypeError('FlatDateTimeField does not accept in-line validators, as it gets errors from its subfields.')
+        date_valid = self.date.validate(form)
+        time_valid = self.time.validate(form)
+        return date_valid and time_valid
+
+    @property
+    def errors(self):
+        return dict(
+            (field.short_name, field.errors) for field in self if field.errors)
+
+    def populate_obj(self, obj, name):
+        setattr(obj, name, self.data)
+
+    @property
+    def data(self):
+        date_data = self.date.data
+        time_data = self.time.data or datetime.time(0, 0)
+        if date_data:
+            return datetime.datetime.combine(date_data, time_data)
+
+
 class ChosenSelectWidget(widgets.Select):
     """
         `Chosen <http://harvesthq.github.com/chosen/>`_ styled select widget.
@@ -146,7 +320,191 @@ class ChosenSelectWidget(widgets.Select):
         return super(ChosenSelectWidget, self).__call__(field, **kwargs)
 
 
+def render_option(value, label, selected):
+    """
+    Equivalent to ``widgets.Select.render_option`` for the common case of no
+    extra attributes, without the overhead of ``html_params``.
+    """
+    if value is True:
+        value = text_type(value)
+    return u'<option %svalue="%s">%s</option>' % (
+        selected and u'selected ' or u'',
+        escape(text_type(value), quote=True),
+        escape(text_type(label), quote=False))
+
+
+class StreamingSelectWidget(ChosenSelectWidget):
+    """
+        Chosen select widget which can render its options incrementally.
+
+        `stream()` returns a generator of HTML chunks of at most `chunk_size`
+        options each, suitable for a streamed response, e.g. with Flask:
+        ``Response(stream_with_context(form.category.stream()))``. Calling the
+        widget renders the whole select at once, like `ChosenSelectWidget`.
+    """
+    def __init__(self, multiple=False, chunk_size=500):
+        super(StreamingSelectWidget, self).__init__(multiple)
+        self.chunk_size = chunk_size
+
+    def __call__(self, field, **kwargs):
+        return HTMLString(u''.join(self.stream(field, **kwargs)))
+
+    def stream(self, field, **kwargs):
+        if getattr(field, 'allow_blank', False) and not self.multiple:
+            kwargs['data-role'] = u'chosenblank'
+        else:
+            kwargs['data-role'] = u'chosen'
+        kwargs.setdefault('id', field.id)
+        if self.multiple:
+            kwargs['multiple'] = True
+
+        yield u'<select %s>' % html_params(name=field.name, **kwargs)
+        chunk = []
+        for value, label, selected in field.iter_choices():
+            chunk.append(render_option(value, label, selected))
+            if len(chunk) >= self.chunk_size:
+                yield u''.join(chunk)
+                chunk = []
+        chunk.append(u'</select>')
+        yield u''.join(chunk)
+
+
+class CachedSelectWidget(ChosenSelectWidget):
+    """
+        Chosen select widget which keeps the rendered HTML in a
+        `wtfpeewee.cache.FragmentCache`, keyed by the field's choice set and
+        the widget attributes. Repeated renders only splice the ``selected``
+        markers into the cached markup.
+
+        This requires a query-backed field with a `choice_cache`, whose cached
+        choice tuple serves as the version of the fragment; other fields are
+        rendered as usual.
+    """
+    def __init__(self, multiple=False, fragment_cache=None):
+        super(CachedSelectWidget, self).__init__(multiple)
+        if fragment_cache is None:
+            fragment_cache = default_fragment_cache
+        self.fragment_cache = fragment_cache
+
+    def __call__(self, field, **kwargs):
+        cached_choices = getattr(field, 'cached_choices', None)
+        choice_set = cached_choices() if cached_choices is not None else None
+        if choice_set is None:
+            return super(CachedSelectWidget, self).__call__(field, **kwargs)
+
+        if field.allow_blank and not self.multiple:
+            kwargs['data-role'] = u'chosenblank'
+        else:
+            kwargs['data-role'] = u'chosen'
+        kwargs.setdefault('id', field.id)
+        if self.multiple:
+            kwargs['multiple'] = True
+
+        choice_key, version = choice_set
+        try:
+            key = (choice_key, type(field), field.name, field.allow_blank,
+                   field.blank_text, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return super(CachedSelectWidget, self).__call__(field, **kwargs)
+
+        fragment = self.fragment_cache.get(key, version)
+        if fragment is None:
+            fragment = self.render_fragment(field, **kwargs)
+            self.fragment_cache.set(key, version, fragment)
+        html, offsets = fragment
+
+        positions = sorted(
+            offsets[value] for value in field.selected_values()
+            if value in offsets)
+        parts = []
+        last = 0
+        for position in positions:
+            parts.append(html[last:position])
+            parts.append(u'selected ')
+            last = position
+        parts.append(html[last:])
+        return HTMLString(u''.join(parts))
+
+    def render_fragment(self, field, **kwargs):
+        """
+        Render the select with nothing selected, returning the HTML and a
+        dictionary of option value to the offset of its ``selected`` marker.
+        """
+        parts = [u'<select %s>' % html_params(name=field.name, **kwargs)]
+        length = len(parts[0])
+        offsets = {}
+        for value, label, _ in field.iter_choices():
+            option = render_option(value, label, False)
+            offsets.setdefault(value, length + len(u'<option '))
+            parts.append(option)
+            length += len(option)
+        parts.append(u'</select>')
+        return u''.join(parts), offsets
+
+
+_choice_indexes = OrderedDict()
+_choice_indexes_lock = threading.Lock()
+CHOICE_INDEX_CACHE_SIZE = 256
+
+
+def _snapshot(choices):
+    # Tuples cannot be changed in place, so only other sequences are copied
+    # to detect in-place changes.
+    if isinstance(choices, tuple):
+        return None
+    return list(choices)
+
+
+def _build_choice_index(choices, coerce):
+    coerced = []
+    for value, _ in choices:
+        try:
+            coerced.append(coerce(value))
+        except (ValueError, TypeError):
+            coerced.append(_NO_CHOICE)
+    try:
+        values = set(value for value, _ in choices)
+        selectable = set(coerced)
+    except TypeError:
+        values = selectable = None
+    return (choices, _snapshot(choices), coerced, values, selectable)
+
+
+def choice_index(choices, coerce):
+    """
+    Return the coerced value of each of `choices`, along with sets of the raw
+    and coerced values (`None` if the values cannot be hashed). Indexes are
+    cached by choice list and `coerce`, so every field bound from the same
+    unbound field shares one. A list changed in place since it was indexed
+    (checked by comparing it with a copy, without coercing) is reindexed.
+    """
+    choices = choices or ()
+    key = (id(choices), coerce)
+    try:
+        hash(key)
+    except TypeError:
+        return _build_choice_index(choices, coerce)[2:]
+
+    with _choice_indexes_lock:
+        index = _choice_indexes.pop(key, None)
+        if (index is None or index[0] is not choices or
+                index[1] != _snapshot(choices)):
+            index = _build_choice_index(choices, coerce)
+        # The index holds a reference to the choices, so their id cannot be
+        # recycled while cached.
+        _choice_indexes[key] = index
+        while len(_choice_indexes) > CHOICE_INDEX_CACHE_SIZE:
+            _choice_indexes.popitem(last=False)
+    return index[2:]
+
+
 class SelectChoicesField(fields.SelectField):
+    """
+    A select field over a static list of choices. The choices are coerced
+    once and indexed (see `choice_index`), so marking the selected option and
+    validating do not depend on the number of choices.
+    """
     widget = ChosenSelectWidget()
 
     # all of this exists so i can get proper handling of None
@@ -155,12 +513,22 @@ class SelectChoicesField(fields.SelectField):
         self.allow_blank = allow_blank
         self.blank_text = blank_text or '----------------'
 
+    def choice_index(self):
+        """Return ``(coerced values, raw value set, coerced value set)``."""
+        return choice_index(self.choices, self.coerce)
+
     def iter_choices(self):
         if self.allow_blank:
             yield (u'__None', self.blank_text, self.data is None)
 
-        for value, label in self.choices:
-            yield (value, label, self.coerce(value) == self.data)
+        coerced, values, selectable = self.choice_index()
+        data = self.data
+        try:
+            found = selectable is None or data in selectable
+        except TypeError:
+            found = True
+        for (value, label), key in zip(self.choices or (), coerced):
+            yield (value, label, found and key == data)
 
     def process_data(self, value):
         if value is None:
@@ -184,7 +552,16 @@ class SelectChoicesField(fields.SelectField):
     def pre_validate(self, form):
         if self.allow_blank and self.data is None:
             return
-        super(SelectChoicesField, self).pre_validate(form)
+        values = self.choice_index()[1]
+        try:
+            valid = values is not None and self.data in values
+        except TypeError:
+            values = None
+        if values is None:
+            # Unhashable values, fall back to scanning the choices.
+            super(SelectChoicesField, self).pre_validate(form)
+        elif not valid:
+            raise ValueError(self.gettext('Not a valid choice'))
 
 
 class SelectQueryField(fields.SelectFieldBase):
@@ -204,16 +581,53 @@ class SelectQueryField(fields.SelectFieldBase):
     top of the list. Selecting this choice will result in the `data` property
     being `None`.  The label for the blank choice can be set by specifying the
     `blank_text` parameter.
+
+    If `choice_cache` is a `wtfpeewee.cache.ChoiceCache` (or `True`, to use the
+    shared cache), the rendered ``(pk, label)`` pairs are cached rather than
+    querying the database on every render.
+
+    Specify `label_columns` (field names, fields or SQL expressions) to load
+    the choices as tuples of just the primary key and those columns, instead
+    of fetching and building a model instance per row. The label is then the
+    column values joined with spaces, or the result of calling
+    `format_label` with the column values.
+
+    If `pk_only` is `True`, `data` holds the primary key rather than a model
+    instance, so submitted values are not loaded and `populate_obj` writes
+    the id straight to the foreign key. The key is validated with a cheap
+    existence query, or not at all if `check_exists` is `False` (leaving it
+    to the database's foreign key constraint).
     """
     widget = ChosenSelectWidget()
 
-    def __init__(self, label=None, validators=None, query=None, get_label=None, allow_blank=False, blank_text=u'', **kwargs):
+    def __init__(self, label=None, validators=None, query=None, get_label=None, allow_blank=False, blank_text=u'', choice_cache=None, label_columns=None, format_label=None, pk_only=False, check_exists=True, **kwargs):
         super(SelectQueryField, self).__init__(label, validators, **kwargs)
+        self.pk_only = pk_only
+        self.check_exists = check_exists
         self.allow_blank = allow_blank
         self.blank_text = blank_text or '----------------'
         self.query = query
         self.model = query.model_class
         self._set_data(None)
+        self._choices = None
+
+        if choice_cache is True:
+            choice_cache = default_choice_cache
+        self.choice_cache = choice_cache
+
+        if label_columns is not None:
+            if not isinstance(label_columns, (list, tuple)):
+                label_columns = [label_columns]
+            label_columns = [
+                self.model._meta.fields[col] if isinstance(col, string_types) else col
+                for col in label_columns]
+            # The columns are part of the choice query's SQL, which is already
+            # in the cache key, and SQL expressions are not hashable.
+            self._label_key = ('label_columns', format_label)
+        else:
+            self._label_key = get_label
+        self.label_columns = label_columns
+        self.format_label = format_label or (lambda *values: u' '.join(text_type(v) for v in values))
 
         if get_label is None:
             self.get_label = lambda o: text_type(o)
@@ -224,32 +638,197 @@ class SelectQueryField(fields.SelectFieldBase):
 
     def get_model(self, pk):
         try:
-            return self.query.where(self.model._meta.primary_key==pk).get()
-        except self.model.DoesNotExist:
+            pk = self.model._meta.primary_key.python_value(pk)
+            return load_instances(self.query, [pk]).get(pk)
+        except (ValueError, TypeError):
             pass
 
+    def _resolve(self, pk):
+        if self.pk_only:
+            data = coerce_pk(self.model, pk)
+            self._set_data(data)
+            self._invalid = data is None
+            return
+        # An instance loaded through the field's own query is known to be a
+        # valid choice, so pre_validate() does not need to query again.
+        data = self.get_model(pk)
+        self._set_data(data)
+        self._verified = data is not None
+        self._invalid = data is None
+
     def _get_data(self):
         if self._formdata is not None:
-            self._set_data(self.get_model(self._formdata))
+            self._resolve(self._formdata)
         return self._data
 
     def _set_data(self, data):
+        if self.pk_only and isinstance(data, Model):
+            data = data._get_pk_value()
         self._data = data
         self._formdata = None
+        self._verified = False
+        self._invalid = False
 
     data = property(_get_data, _set_data)
 
+    def selected_pk(self):
+        """The primary key of the selected choice, or `None`."""
+        data = self.data
+        if data is None or self.pk_only:
+            return data
+        return data.get_id()
+
+    def pending_pks(self):
+        """
+        Return the coerced primary keys of submitted data which has not been
+        looked up yet, or `None` if there is nothing to resolve.
+        """
+        if self._formdata is None or self.pk_only:
+            return None
+        try:
+            return [self.model._meta.primary_key.python_value(self._formdata)]
+        except (ValueError, TypeError):
+            return []
+
+    def resolve_pending(self, instances):
+        """
+        Resolve pending submitted data from `instances`, a mapping of primary
+        key to model instance loaded through this field's query.
+        """
+        pks = self.pending_pks()
+        data = instances.get(pks[0]) if pks else None
+        self._set_data(data)
+        self._verified = data is not None
+        self._invalid = data is None
+
+    def unverified_pks(self):
+        """
+        Return the primary keys of the current data which `pre_validate` would
+        check against the query, or `None` if there is nothing to check.
+        """
+        if self._formdata is not None and not self.pk_only:
+            return None
+        selected = self.selected_pk()
+        if self._verified or selected is None:
+            return None
+        elif self.pk_only and not self.check_exists:
+            return None
+        return [selected]
+
+    def mark_verified(self, existing):
+        """
+        Record the result of checking `unverified_pks`, where `existing` is
+        the set of those selected by the query.
+        """
+        if self.selected_pk() in existing:
+            self._verified = True
+        else:
+            self._set_data(None)
+            self._invalid = True
+
     def __call__(self, **kwargs):
         if 'value' in kwargs:
-            self._set_data(self.get_model(kwargs['value']))
+            self._resolve(kwargs['value'])
         return self.widget(self, **kwargs)
 
+    def stream(self, **kwargs):
+        """
+        Render the field as a generator of HTML chunks, see
+        `StreamingSelectWidget`.
+        """
+        if 'value' in kwargs:
+            self._resolve(kwargs['value'])
+        widget = self.widget
+        if not hasattr(widget, 'stream'):
+            widget = StreamingSelectWidget(multiple=getattr(widget, 'multiple', False))
+        return widget.stream(self, **kwargs)
+
+    def choice_query(self):
+        """The query used to list the choices."""
+        if self.label_columns is not None:
+            pk = self.model._meta.primary_key
+            return self.query.clone().select(pk, *self.label_columns).tuples()
+        return self.query
+
+    def load_choice_pairs(self, query=None):
+        if query is None:
+            query = self.choice_query()
+        return self.choice_pairs(iterate_rows(query))
+
+    def choice_pairs(self, rows):
+        """Convert rows returned by `choice_query` to ``(pk, label)`` pairs."""
+        if self.label_columns is not None:
+            format_label = self.format_label
+            for row in rows:
+                yield (row[0], format_label(*row[1:]))
+        else:
+            for obj in rows:
+                yield (obj.get_id(), self.get_label(obj))
+
+    def preload_choices(self, rows):
+        """
+        Use `rows`, the result of running `choice_query` elsewhere, as the
+        field's choices instead of querying when rendering.
+        """
+        self._choices = tuple(self.choice_pairs(rows))
+        if self.choice_cache is not None:
+            self.choice_cache.set(
+                self.choice_cache.make_key(self.choice_query(), self._label_key),
+                self.model,
+                self._choices)
+
+    def cached_choices(self):
+        """
+        Return the choice cache key and the cached tuple of ``(pk, label)``
+        pairs, or `None` if the field does not use a choice cache.
+        """
+        if self.choice_cache is None:
+            return None
+        query = self.choice_query()
+        load = lambda: self.load_choice_pairs(query)
+        key = self.choice_cache.make_key(query, self._label_key)
+        return key, self.choice_cache.get_choices(query, load, self._label_key)
+
+    def cached_membership(self, pks):
+        """
+        Return whether all of `pks` are choices, if that can be answered from
+        an indexed choice list (such as `CompactChoices`) which is already
+        cached, otherwise `None`.
+        """
+        if self.choice_cache is None:
+            return None
+        key = self.choice_cache.make_key(self.choice_query(), self._label_key)
+        has_pk = getattr(self.choice_cache.get(key), 'has_pk', None)
+        if has_pk is None:
+            return None
+        return all(has_pk(pk) for pk in pks)
+
+    def iter_choice_pairs(self):
+        """Yield a ``(pk, label)`` 2-tuple for each choice."""
+        if self._choices is not None:
+            for pair in self._choices:
+                yield pair
+        elif self.choice_cache is not None:
+            for pair in self.cached_choices()[1]:
+                yield pair
+        else:
+            for pair in self.load_choice_pairs():
+                yield pair
+
+    def selected_values(self):
+        """The option values `iter_choices` marks as selected."""
+        selected = self.selected_pk()
+        if selected is None:
+            return [u'__None'] if self.allow_blank else []
+        return [selected]
+
     def iter_choices(self):
+        selected = self.selected_pk()
         if self.allow_blank:
-            yield (u'__None', self.blank_text, self.data is None)
+            yield (u'__None', self.blank_text, selected is None)
 
-        for obj in self.query.clone():
-            yield (obj.get_id(), self.get_label(obj), obj == self.data)
+        for pk, label in self.iter_choice_pairs():
+            yield (pk, label, selected is not None and pk == selected)
 
     def process_formdata(self, valuelist):
         if valuelist:
@@ -260,9 +839,17 @@ class SelectQueryField(fields.SelectFieldBase):
                 self._formdata = valuelist[0]
 
     def pre_validate(self, form):
-        if self.data is not None:
-            if not self.query.where(self.model._meta.primary_key==self.data.get_id()).exists():
+        selected = self.selected_pk()
+        if selected is not None:
+            if self._verified or (self.pk_only and not self.check_exists):
+                return
+            valid = self.cached_membership([selected])
+            if valid is None:
+                valid = self.query.where(self.model._meta.primary_key==selected).exists()
+            if not valid:
                 raise ValidationError(self.gettext('Not a valid choice'))
+        elif self._invalid:
+            raise ValidationError(self.gettext('Not a valid choice'))
         elif not self.allow_blank:
             raise ValidationError(self.gettext('Selection cannot be blank'))
 
@@ -272,48 +859,114 @@ class SelectMultipleQueryField(SelectQueryField):
 
     def __init__(self, *args, **kwargs):
         kwargs.pop('allow_blank', None)
+        kwargs.pop('pk_only', None)
         super(SelectMultipleQueryField, self).__init__(*args, **kwargs)
 
     def get_model_list(self, pk_list):
         if pk_list:
-            return list(self.query.where(self.model._meta.primary_key << pk_list))
+            return list(load_instances(self.query, pk_list).values())
         return []
 
+    def _resolve(self, pk_list):
+        # Rows loaded through the field's own query are known to be valid
+        # choices, so pre_validate() does not need to count them again; any
+        # submitted pk without a row is not a valid choice.
+        rows = self.get_model_list(pk_list)
+        self._set_data(rows)
+        self._verified = True
+        self._invalid = len(rows) != len(pk_list)
+
     def _get_data(self):
         if self._formdata is not None:
-            self._set_data(self.get_model_list(self._formdata))
+            self._resolve(self._formdata)
         return self._data or []
 
     def _set_data(self, data):
         self._data = data
         self._formdata = None
+        self._verified = False
+        self._invalid = False
 
     data = property(_get_data, _set_data)
 
+    def pending_pks(self):
+        return self._formdata
+
+    def resolve_pending(self, instances):
+        wanted = set(self._formdata or ())
+        rows = [obj for pk, obj in instances.items() if pk in wanted]
+        self._set_data(rows)
+        self._verified = True
+        self._invalid = len(rows) != len(wanted)
+
+    def unverified_pks(self):
+        if self._formdata is not None or self._verified:
+            return None
+        return [obj.get_id() for obj in self.data] or None
+
+    def mark_verified(self, existing):
+        self._verified = True
+        self._invalid = not all(obj.get_id() in existing for obj in self.data)
+
     def __call__(self, **kwargs):
         if 'value' in kwargs:
-            self._set_data(self.get_model_list(kwargs['value']))
+            self._resolve(self.coerce_pks(kwargs['value']))
         return self.widget(self, **kwargs)
 
+    def selected_values(self):
+        return [obj.get_id() for obj in self.data]
+
     def iter_choices(self):
-        for obj in self.query.clone():
-            yield (obj.get_id(), self.get_label(obj), obj in self.data)
+        selected = set(obj.get_id() for obj in self.data)
+        for pk, label in self.iter_choice_pairs():
+            yield (pk, label, pk in selected)
+
+    def coerce_pks(self, values):
+        """
+        Convert submitted values using the model's primary key field, dropping
+        duplicates while preserving order.
+        """
+        python_value = self.model._meta.primary_key.python_value
+        pks = []
+        seen = set()
+        for value in values:
+            pk = python_value(value)
+            if pk not in seen:
+                seen.add(pk)
+                pks.append(pk)
+        return pks
 
     def process_formdata(self, valuelist):
         if valuelist:
             self._data = []
-            self._formdata = list(map(int, valuelist))
+            try:
+                self._formdata = self.coerce_pks(valuelist)
+            except (ValueError, TypeError):
+                self._formdata = None
+                raise ValueError(self.gettext('Invalid choice(s): one or more data inputs could not be coerced'))
 
     def pre_validate(self, form):
-        if self.data:
-            id_list = [m.get_id() for m in self.data]
-            if id_list and not self.query.where(self.model._meta.primary_key << id_list).count() == len(id_list):
+        data = self.data
+        if self._invalid:
+            raise ValidationError(self.gettext('Not a valid choice'))
+        elif data and not self._verified:
+            id_list = set(m.get_id() for m in data)
+            valid = self.cached_membership(id_list)
+            if valid is None:
+                valid = self.query.where(self.model._meta.primary_key << list(id_list)).count() == len(id_list)
+            if not valid:
                 raise ValidationError(self.gettext('Not a valid choice'))
 
 
 class HiddenQueryField(fields.HiddenField):
+    """
+    Hidden input holding the primary key of a model instance selected by
+    `query`. See `SelectQueryField` for `pk_only` and `check_exists`.
+    """
     def __init__(self, label=None, validators=None, query=None, get_label=None, **kwargs):
         self.allow_blank = kwargs.pop('allow_blank', False)
+        self.pk_only = kwargs.pop('pk_only', False)
+        self.check_exists = kwargs.pop('check_exists', True)
         super(fields.HiddenField, self).__init__(label, validators, **kwargs)
         self.query = query
         self.model = query.model_class
@@ -321,37 +974,92 @@ class HiddenQueryField(fields.HiddenField):
 
         if get_label is None:
             self.get_label = lambda o: text_type(o)
-        elif isinstance(get_label, basestring):
+        elif isinstance(get_label, string_types):
             self.get_label = operator.attrgetter(get_label)
         else:
             self.get_label = get_label
 
     def get_model(self, pk):
         try:
-            return self.query.where(self.model._meta.primary_key==pk).get()
-        except self.model.DoesNotExist:
+            pk = self.model._meta.primary_key.python_value(pk)
+            return load_instances(self.query, [pk]).get(pk)
+        except (ValueError, TypeError):
             pass
 
+    def _resolve(self, pk):
+        if self.pk_only:
+            data = coerce_pk(self.model, pk)
+        else:
+            data = self.get_model(pk)
+        self._set_data(data)
+        self._invalid = data is None
+
     def _get_data(self):
         if self._formdata is not None:
             if self.allow_blank and self._formdata == '__None':
                 self._set_data(None)
             else:
-                self._set_data(self.get_model(self._formdata))
+                self._resolve(self._formdata)
         return self._data
 
     def _set_data(self, data):
+        if self.pk_only and isinstance(data, Model):
+            data = data._get_pk_value()
         self._data = data
         self._formdata = None
+        self._verified = False
+        self._invalid = False
 
     data = property(_get_data, _set_data)
 
+    def pending_pks(self):
+        if self._formdata is None or self.pk_only or (self.allow_blank and self._formdata == '__None'):
+            return None
+        try:
+            return [self.model._meta.primary_key.python_value(self._formdata)]
+        except (ValueError, TypeError):
+            return []
+
+    def resolve_pending(self, instances):
+        pks = self.pending_pks()
+        data = instances.get(pks[0]) if pks else None
+        self._set_data(data)
+        self._invalid = data is None
+
+    def unverified_pks(self):
+        if not (self.pk_only and self.check_exists):
+            return None
+        data = self.data
+        if self._verified or data is None:
+            return None
+        return [data]
+
+    def mark_verified(self, existing):
+        if self.data in existing:
+            self._verified = True
+        else:
+            self._set_data(None)
+            self._invalid = True
+
     def __call__(self, **kwargs):
         if 'value' in kwargs:
-            self._set_data(self.get_model(kwargs['value']))
+            self._resolve(kwargs['value'])
         return self.widget(self, **kwargs)
 
+    def pre_validate(self, form):
+        # The submitted pk is looked up through the field's own query, so a
+        # resolved instance needs no further membership check.
+        data = self.data
+        if data is None:
+            if self._invalid:
+                raise ValidationError(self.gettext('Not a valid choice'))
+        elif self.pk_only and self.check_exists and not self._verified:
+            if not self.query.where(self.model._meta.primary_key==data).exists():
+                raise ValidationError(self.gettext('Not a valid choice'))
+
     def _value(self):
+        if self.pk_only:
+            return self.data if self.data is not None else ''
         return self.data and self.data.get_id() or ''
 
     def process_formdata(self, valuelist):
@@ -370,6 +1078,139 @@ class ModelSelectField(SelectQueryField):
         super(ModelSelectField, self).__init__(label, validators, query=model.select(), **kwargs)
 
 
+class RemoteSelectWidget(widgets.Select):
+    """
+        Select widget for `RemoteModelSelectField`, which only renders the
+        current selection. Options are expected to be loaded by javascript from
+        the field's `search_url`, given in the ``data-url`` attribute.
+    """
+    def __call__(self, field, **kwargs):
+        kwargs['data-role'] = u'remote'
+        if field.search_url:
+            kwargs.setdefault('data-url', field.search_url)
+        return super(RemoteSelectWidget, self).__call__(field, **kwargs)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, default=text_type).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_cursor(cursor, length):
+    """
+    Decode a cursor made by `encode_cursor`, checking that it holds a list of
+    `length` scalar values, since it comes from the client.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if (not isinstance(values, list) or len(values) != length or
+            not all(v is None or isinstance(v, string_types + integer_types + (float,))
+                    for v in values)):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+class RemoteModelSelectField(ModelSelectField):
+    """
+    A ModelSelectField for large tables: only the current selection is
+    rendered, and the options are searched server-side using `search`.
+
+    `search_fields` are the names of the label columns to filter on, the first
+    of which is also used to order the results. They default to `get_label`
+    if that is a field name. Results are paginated with a
+    keyset cursor over ``(first search field, primary key)``, so each page is
+    an indexed range scan rather than an OFFSET. Validation is a single primary
+    key lookup.
+
+    Example Flask view returning search results::
+
+        @app.route('/customers/search/')
+        def customer_search():
+            return jsonify(OrderForm().customer.search(
+                request.args.get('q'), request.args.get('cursor')))
+    """
+    widget = RemoteSelectWidget()
+
+    # Only the current selection is rendered, there are no choices to load.
+    preload_choices = None
+
+    def __init__(self, label=None, validators=None, model=None, search_fields=None, search_url=None, per_page=20, **kwargs):
+        super(RemoteModelSelectField, self).__init__(label, validators, model=model, **kwargs)
+        if search_fields is None:
+            label_attr = kwargs.get('get_label')
+            search_fields = [label_attr] if isinstance(label_attr, string_types) else []
+        elif isinstance(search_fields, string_types):
+            search_fields = [search_fields]
+        if not search_fields:
+            raise ValueError('RemoteModelSelectField requires search_fields, or a '
+                             'get_label naming a field.')
+        self.search_fields = [model._meta.fields[name] for name in search_fields]
+        self.search_url = search_url
+        self.per_page = per_page
+
+    def iter_choices(self):
+        data = self.data
+        if self.allow_blank:
+            yield (u'__None', self.blank_text, data is None)
+        if data is not None:
+            yield (data.get_id(), self.get_label(data), True)
+
+    def search_query(self, term=None, cursor=None):
+        pk = self.model._meta.primary_key
+        order = self.search_fields[0]
+        query = self.query.clone()
+
+        if term:
+            query = query.where(reduce(
+                operator.or_,
+                [field.contains(term) for field in self.search_fields]))
+
+        if cursor:
+            value, last_pk = decode_cursor(cursor, 2)
+            if value is None:
+                # Rows with a NULL search column come first, ordered by pk.
+                query = query.where(
+                    (order.is_null() & (pk > last_pk)) | order.is_null(False))
+            else:
+                query = query.where(
+                    (order > value) | ((order == value) & (pk > last_pk)))
+
+        if order.null:
+            # Sort NULLs first explicitly, as databases disagree on where
+            # they go and the cursor condition above depends on it.
+            return query.order_by(order.is_null(False), order, pk)
+        return query.order_by(order, pk)
+
+    def search(self, term=None, cursor=None, limit=None):
+        """
+        Search the field's choices, returning a dictionary suitable for
+        serializing as JSON::
+
+            {'results': [{'id': pk, 'text': label}, ...],
+             'cursor': next page cursor or None}
+        """
+        limit = limit or self.per_page
+        rows = list(self.search_query(term, cursor).limit(limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([
+                getattr(last, self.search_fields[0].name), last.get_id()])
+
+        return {
+            'results': [{'id': obj.get_id(), 'text': self.get_label(obj)} for obj in rows],
+            'cursor': next_cursor,
+        }
+
+    def process_formdata(self, valuelist):
+        if valuelist and valuelist[0] == u'':
+            valuelist = [u'__None']
+        super(RemoteModelSelectField, self).process_formdata(valuelist)
+
+
 class ModelSelectMultipleField(SelectMultipleQueryField):
     """
     Like a SelectMultipleQueryField, except takes a model class instead of a
@@ -0,0 +1,345 @@
+"""
+Form base classes with cheaper per-request instantiation.
+"""
+from peewee import Model
+from wtforms.fields.core import Flags
+from wtforms.fields.core import Label
+from wtforms.form import BaseForm
+from wtforms.form import Form
+from wtforms.meta import DefaultMeta
+from wtfpeewee._compat import MutableMapping
+from wtfpeewee._compat import OrderedDict
+from wtfpeewee.cache import load_instances
+
+
+__all__ = (
+    'BatchResolveForm',
+    'CompiledForm',
+    'FormPlan',
+    'LazyForm',
+    'PkOnlyForm',
+    'resolve_query_fields',
+)
+
+
+def _func(method):
+    return getattr(method, '__func__', method)
+
+
+class FormPlan(object):
+    """
+    The pre-computed construction plan for a form class: one prototype field
+    per unbound field, plus the inline ``validate_<name>`` validators.
+
+    Prototypes are bound once (validators, filters, flags, widget and any
+    state the field's ``__init__`` sets up, such as a `ModelSelectField`'s
+    query) and are shallow-copied for each form instance. Field classes whose
+    ``__init__`` creates per-instance mutable state must set ``compilable =
+    False``; such fields are bound from their `UnboundField` for every form.
+    """
+    def __init__(self, form_class):
+        self.source = form_class._unbound_fields
+        meta = form_class._wtforms_meta()
+        self.fields = []
+        self.extra_validators = {}
+        for name, unbound_field in self.source:
+            prototype = None
+            if getattr(unbound_field.field_class, 'compilable', True):
+                prototype = unbound_field.bind(
+                    form=None, name=name, prefix='', translations=None,
+                    _meta=meta)
+            explicit_id = unbound_field.kwargs.get('id')
+            self.fields.append((name, prototype, explicit_id, unbound_field))
+
+            inline = getattr(form_class, 'validate_%s' % name, None)
+            if inline is not None:
+                self.extra_validators[name] = [inline]
+
+    @classmethod
+    def for_class(cls, form_class):
+        plan = form_class.__dict__.get('_form_plan')
+        if plan is None or plan.source is not form_class._unbound_fields:
+            plan = cls(form_class)
+            form_class._form_plan = plan
+        return plan
+
+    def bind(self, form, prefix):
+        meta = form.meta
+        fields = form._fields
+        for name, prototype, explicit_id, unbound_field in self.fields:
+            if prototype is None:
+                field = meta.bind_field(form, unbound_field, {
+                    'name': name, 'prefix': prefix, 'translations': None})
+            else:
+                field = object.__new__(type(prototype))
+                field.__dict__.update(prototype.__dict__)
+                field.meta = meta
+                field.name = prefix + name
+                field.id = explicit_id or field.name
+                field.label = Label(field.id, prototype.label.text)
+                flags = Flags()
+                flags.__dict__.update(prototype.flags.__dict__)
+                field.flags = flags
+            fields[name] = field
+            setattr(form, name, field)
+
+
+class CompiledForm(Form):
+    """
+    A `Form` which binds its fields by copying pre-computed prototypes instead
+    of constructing every field from its `UnboundField`. Inline
+    ``validate_<name>`` validators are looked up once per class.
+
+    Forms using CSRF, translations or a custom ``Meta.bind_field`` fall back to
+    the regular wtforms construction path.
+    """
+    _form_plan = None
+
+    def __init__(self, formdata=None, obj=None, prefix='', data=None,
+                 meta=None, **kwargs):
+        meta_obj = self._wtforms_meta()
+        if meta is not None and isinstance(meta, dict):
+            meta_obj.update_values(meta)
+
+        if (meta_obj.csrf or meta_obj.locales or
+                _func(meta_obj.bind_field) is not _func(DefaultMeta.bind_field)):
+            self._plan = None
+            super(CompiledForm, self).__init__(
+                formdata, obj, prefix, data, meta, **kwargs)
+            return
+
+        if prefix and prefix[-1] not in '-_;:/.':
+            prefix += '-'
+
+        self.meta = meta_obj
+        self._prefix = prefix
+        self._errors = None
+        self._fields = OrderedDict()
+        self._plan = FormPlan.for_class(type(self))
+        self._plan.bind(self, prefix)
+        self.process(formdata, obj, data=data, **kwargs)
+
+    def process(self, formdata=None, obj=None, data=None, **kwargs):
+        if self._plan is None:
+            return super(CompiledForm, self).process(
+                formdata, obj, data=data, **kwargs)
+
+        formdata = self.meta.wrap_formdata(self, formdata)
+        if data is not None:
+            kwargs = dict(data, **kwargs)
+
+        for name, field in self._fields.items():
+            if obj is not None and hasattr(obj, name):
+                value = getattr(obj, name)
+            elif name in kwargs:
+                value = kwargs[name]
+            else:
+                # Let the field resolve its own default, as BaseForm does;
+                # some fields (e.g. FormField) treat that case specially.
+                field.process(formdata)
+                continue
+            field.process(formdata, value)
+
+    def validate(self):
+        plan = FormPlan.for_class(type(self))
+        return BaseForm.validate(self, plan.extra_validators)
+
+
+class LazyFields(MutableMapping):
+    """
+    Ordered mapping of field name to field which binds and processes each
+    field the first time it is looked up.
+    """
+    def __init__(self, form, unbound_fields):
+        self._form = form
+        self._names = [name for name, _ in unbound_fields]
+        self._unbound = dict(unbound_fields)
+        self._bound = {}
+
+    def is_bound(self, name):
+        return name in self._bound
+
+    def bound_items(self):
+        return [(name, self._bound[name]) for name in self._names
+                if name in self._bound]
+
+    def __getitem__(self, name):
+        try:
+            return self._bound[name]
+        except KeyError:
+            if name not in self._unbound:
+                raise
+        return self._form._bind_field(name, self._unbound.pop(name))
+
+    def __setitem__(self, name, field):
+        if name not in self._bound and name not in self._unbound:
+            self._names.append(name)
+        self._unbound.pop(name, None)
+        self._bound[name] = field
+
+    def __delitem__(self, name):
+        if name not in self._bound and name not in self._unbound:
+            raise KeyError(name)
+        self._names.remove(name)
+        self._bound.pop(name, None)
+        self._unbound.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._bound or name in self._unbound
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+
+class LazyForm(Form):
+    """
+    A `Form` which defers binding and processing each field until it is first
+    used, whether by attribute or item access, iteration, ``validate()``,
+    ``populate_obj()`` or the ``data``/``errors`` properties. Rendering a few
+    fields of a wide form only pays for those fields.
+    """
+    def __init__(self, formdata=None, obj=None, prefix='', data=None,
+                 meta=None, **kwargs):
+        meta_obj = self._wtforms_meta()
+        if meta is not None and isinstance(meta, dict):
+            meta_obj.update_values(meta)
+
+        if prefix and prefix[-1] not in '-_;:/.':
+            prefix += '-'
+
+        self.meta = meta_obj
+        self._prefix = prefix
+        self._errors = None
+        self._field_translations = self._get_translations()
+
+        unbound_fields = list(self._unbound_fields)
+        if meta_obj.csrf:
+            self._csrf = meta_obj.build_csrf(self)
+            unbound_fields.extend(self._csrf.setup_form(self))
+
+        self._fields = LazyFields(self, unbound_fields)
+        self.process(formdata, obj, data=data, **kwargs)
+
+    def __getattribute__(self, name):
+        if name[0] != '_':
+            fields = object.__getattribute__(self, '__dict__').get('_fields')
+            if fields is not None and name in fields._unbound:
+                return fields[name]
+        return object.__getattribute__(self, name)
+
+    def _bind_field(self, name, unbound_field):
+        options = dict(
+            name=name,
+            prefix=self._prefix,
+            translations=self._field_translations)
+        field = self.meta.bind_field(self, unbound_field, options)
+        self._fields[name] = field
+        setattr(self, name, field)
+        self._process_field(name, field)
+        return field
+
+    def _process_field(self, name, field):
+        formdata, obj, kwargs = self._process_args
+        if obj is not None and hasattr(obj, name):
+            field.process(formdata, getattr(obj, name))
+        elif name in kwargs:
+            field.process(formdata, kwargs[name])
+        else:
+            field.process(formdata)
+
+    def process(self, formdata=None, obj=None, data=None, **kwargs):
+        formdata = self.meta.wrap_formdata(self, formdata)
+        if data is not None:
+            kwargs = dict(data, **kwargs)
+
+        self._process_args = (formdata, obj, kwargs)
+        for name, field in self._fields.bound_items():
+            self._process_field(name, field)
+
+
+def pending_query_groups(form, method='pending_pks'):
+    """
+    Collect the pending primary keys of every query-backed field on `form`
+    (any field providing ``pending_pks()`` and ``resolve_pending()``), grouped
+    by model and query. Returns a list of ``(query, [(field, pks), ...])``.
+
+    `method` names the field method returning the primary keys to collect.
+    """
+    groups = OrderedDict()
+    for field in form:
+        get_pks = getattr(field, method, None)
+        if get_pks is None:
+            continue
+        pks = get_pks()
+        if pks is None:
+            continue
+        sql, params = field.query.sql()
+        key = (field.query.database, sql, tuple(params))
+        if key not in groups:
+            groups[key] = (field.query, [])
+        groups[key][1].append((field, pks))
+    return list(groups.values())
+
+
+def resolve_query_fields(form):
+    """
+    Resolve the submitted data of every query-backed field on `form` using one
+    ``IN`` query per distinct model and query, rather than one lookup per
+    field.
+    """
+    for query, members in pending_query_groups(form):
+        all_pks = set()
+        for field, pks in members:
+            all_pks.update(pks)
+        instances = load_instances(query, list(all_pks))
+        for field, pks in members:
+            field.resolve_pending(instances)
+
+
+class BatchResolveForm(Form):
+    """
+    A `Form` which resolves all of its query-backed fields with
+    `resolve_query_fields` before running validation.
+    """
+    def validate(self):
+        resolve_query_fields(self)
+        return super(BatchResolveForm, self).validate()
+
+
+class _RawValues(object):
+    """
+    Wraps a model instance so that reading any of `names` returns the raw
+    column value (for a foreign key, the id) instead of going through the
+    field's descriptor, which would load the related row.
+    """
+    def __init__(self, obj, names):
+        self._obj = obj
+        self._names = names
+
+    def __getattr__(self, name):
+        if name in self._names and name in self._obj._data:
+            return self._obj._data[name]
+        return getattr(self._obj, name)
+
+
+def _pk_only_names(form_class):
+    return frozenset(
+        name for name, unbound_field in form_class._unbound_fields
+        if unbound_field.kwargs.get('pk_only'))
+
+
+class PkOnlyForm(Form):
+    """
+    A `Form` which hands its ``pk_only`` fields the raw foreign key value of
+    the `obj` it is given, so editing an instance does not query for the
+    related rows. `model_form` adds it for any form with ``pk_only`` fields.
+    """
+    def process(self, formdata=None, obj=None, data=None, **kwargs):
+        if isinstance(obj, Model):
+            names = _pk_only_names(type(self))
+            if names:
+                obj = _RawValues(obj, names)
+        super(PkOnlyForm, self).process(formdata, obj, data=data, **kwargs)
@@ -2,8 +2,10 @@
 Tools for generating forms based on Peewee models
 (cribbed from wtforms.ext.django)
 """
-
+import threading
+import types
 from collections import namedtuple
+
 from wtforms import Form
 from wtforms import fields as f
 from wtforms import validators
@@ -13,6 +15,13 @@ from wtfpeewee.fields import SelectQueryField
 from wtfpeewee.fields import WPDateField
 from wtfpeewee.fields import WPDateTimeField
 from wtfpeewee.fields import WPTimeField
+from wtfpeewee.fields import choice_index
+from wtfpeewee.forms import BatchResolveForm
+from wtfpeewee.forms import CompiledForm
+from wtfpeewee.forms import LazyForm
+from wtfpeewee.forms import PkOnlyForm
+from wtfpeewee._compat import OrderedDict
+from wtfpeewee._compat import string_types
 from wtfpeewee._compat import text_type
 
 from peewee import BareField
@@ -35,7 +44,9 @@ from peewee import TimestampField
 
 __all__ = (
     'FieldInfo',
+    'FormCache',
     'ModelConverter',
+    'form_cache',
     'model_fields',
     'model_form')
 
@@ -90,6 +101,38 @@ class ModelConverter(object):
 
         self.overrides = overrides or {}
 
+        # Maps peewee field classes to the resolved (key, handler, is_default)
+        # triple, see `get_converter`.
+        self._dispatch = {}
+
+    def get_converter(self, field):
+        """
+        Resolve the converter for a peewee field by walking its class' MRO,
+        preferring `converters` over `defaults`. Returns a 3-tuple of the
+        matching peewee field class, the converter and whether the converter is
+        one of the `defaults`, or `None` if the field cannot be converted.
+        Lookups are cached per field class.
+        """
+        field_class = type(field)
+        try:
+            return self._dispatch[field_class]
+        except KeyError:
+            pass
+
+        resolved = None
+        for klass in field_class.__mro__:
+            if klass in self.converters:
+                resolved = (klass, self.converters[klass], False)
+                break
+        else:
+            for klass in field_class.__mro__:
+                if klass in self.defaults:
+                    resolved = (klass, self.defaults[klass], True)
+                    break
+
+        self._dispatch[field_class] = resolved
+        return resolved
+
     def handle_foreign_key(self, model, field, **kwargs):
         if field.null:
             kwargs['allow_blank'] = True
@@ -136,35 +179,49 @@ class ModelConverter(object):
         if hasattr(field, 'wtf_field'):
             return FieldInfo(field.name, field.wtf_field(model, **kwargs))
 
-        for converter in self.converters:
-            if isinstance(field, converter):
-                return self.converters[converter](model, field, **kwargs)
-        else:
-            for converter in self.defaults:
-                if not isinstance(field, converter):
-                    # Early-continue because it simplifies reading the following code.
-                    continue
-                if issubclass(self.defaults[converter], f.FormField):
-                    # FormField fields (i.e. for nested forms) do not support
-                    # filters.
-                    kwargs.pop('filters')
-                if field.choices or 'choices' in kwargs:
-                    choices = kwargs.pop('choices', field.choices)
-                    if converter in self.coerce_settings or 'coerce' in kwargs:
-                        coerce_fn = kwargs.pop('coerce',
-                                               self.coerce_settings[converter])
-                        allow_blank = kwargs.pop('allow_blank', field.null)
-                        kwargs.update({
-                            'choices': choices,
-                            'coerce': coerce_fn,
-                            'allow_blank': allow_blank})
-
-                        return FieldInfo(field.name, SelectChoicesField(**kwargs))
-
-                return FieldInfo(field.name, self.defaults[converter](**kwargs))
-
-        raise AttributeError("There is not possible conversion "
-                             "for '%s'" % type(field))
+        resolved = self.get_converter(field)
+        if resolved is None:
+            raise AttributeError("There is not possible conversion "
+                                 "for '%s'" % type(field))
+
+        converter, handler, is_default = resolved
+        if not is_default:
+            return handler(model, field, **kwargs)
+
+        if issubclass(handler, f.FormField):
+            # FormField fields (i.e. for nested forms) do not support
+            # filters.
+            kwargs.pop('filters')
+        if field.choices or 'choices' in kwargs:
+            choices = kwargs.pop('choices', field.choices)
+            if converter in self.coerce_settings or 'coerce' in kwargs:
+                coerce_fn = kwargs.pop('coerce',
+                                       self.coerce_settings.get(converter))
+                allow_blank = kwargs.pop('allow_blank', field.null)
+                kwargs.update({
+                    'choices': choices,
+                    'coerce': coerce_fn,
+                    'allow_blank': allow_blank})
+                if coerce_fn is not None:
+                    # Coerce the choices now rather than on the first request.
+                    choice_index(choices, coerce_fn)
+
+                return FieldInfo(field.name, SelectChoicesField(**kwargs))
+
+        return FieldInfo(field.name, handler(**kwargs))
+
+
+def _names_key(names):
+    if not names:
+        return None
+    if isinstance(names, string_types):
+        names = (names,)
+    return frozenset(names)
+
+
+# Shared converter used when none is given, so that its dispatch table is
+# built once rather than on every model_form() call.
+_default_converter = ModelConverter()
 
 
 def model_fields(model, allow_pk=False, only=None, exclude=None,
@@ -174,7 +231,7 @@ def model_fields(model, allow_pk=False, only=None, exclude=None,
 
     See `model_form` docstring for description of parameters.
     """
-    converter = converter or ModelConverter()
+    converter = converter or _default_converter
     field_args = field_args or {}
 
     model_fields = list(model._meta.sorted_fields)
@@ -182,8 +239,10 @@ def model_fields(model, allow_pk=False, only=None, exclude=None,
         model_fields.pop(0)
 
     if only:
+        only = _names_key(only)
         model_fields = [x for x in model_fields if x.name in only]
     elif exclude:
+        exclude = _names_key(exclude)
         model_fields = [x for x in model_fields if x.name not in exclude]
 
     field_dict = {}
@@ -197,8 +256,119 @@ def model_fields(model, allow_pk=False, only=None, exclude=None,
     return field_dict
 
 
+def _fingerprint(obj, _seen=None):
+    """
+    Reduce `obj` (typically a `field_args` dictionary) to a hashable value
+    suitable for use in a cache key. Instances which are hashed by identity,
+    such as validators, are compared by their type and public attributes, and
+    functions by their code, defaults and closure, so that equivalent
+    `field_args` built on every call share a key.
+    """
+    if _seen is None:
+        _seen = set()
+    if isinstance(obj, dict):
+        return tuple(sorted(
+            ((k, _fingerprint(v, _seen)) for k, v in obj.items()),
+            key=lambda item: repr(item[0])))
+    elif isinstance(obj, (list, tuple)):
+        return (type(obj).__name__,) + tuple(_fingerprint(v, _seen) for v in obj)
+    elif isinstance(obj, (set, frozenset)):
+        return frozenset(_fingerprint(v, _seen) for v in obj)
+    elif isinstance(obj, types.FunctionType):
+        try:
+            cells = [cell.cell_contents for cell in obj.__closure__ or ()]
+        except ValueError:
+            return obj
+        return ('function', obj.__code__, _fingerprint(obj.__defaults__, _seen),
+                _fingerprint(cells, _seen))
+    elif (type(obj).__hash__ is object.__hash__ and hasattr(obj, '__dict__') and
+            not isinstance(obj, (type, types.ModuleType)) and id(obj) not in _seen):
+        _seen.add(id(obj))
+        attrs = dict((k, v) for k, v in obj.__dict__.items()
+                     if not k.startswith('_'))
+        return (type(obj), _fingerprint(attrs, _seen))
+    try:
+        hash(obj)
+    except TypeError:
+        return ('id', id(obj))
+    return obj
+
+
+class FormCache(object):
+    """
+    Bounded LRU cache of form classes generated by `model_form`.
+
+    Cached classes are shared between callers, so they should be treated as
+    read-only. After a schema change, call `invalidate` with the affected model
+    (or `clear` to drop everything).
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._classes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._classes)
+
+    def make_key(self, model, base_class, allow_pk, only, exclude, field_args,
+                 converter):
+        return (
+            model,
+            base_class,
+            bool(allow_pk),
+            _names_key(only),
+            _names_key(exclude),
+            _fingerprint(field_args or {}),
+            converter)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                entry = self._classes.pop(key)
+            except KeyError:
+                return None
+            self._classes[key] = entry
+            return entry[0]
+
+    def set(self, key, form_class, field_args=None):
+        with self._lock:
+            self._classes.pop(key, None)
+            # Hold a reference to the field_args so the ids of any unhashable
+            # values used in the key cannot be recycled while cached.
+            self._classes[key] = (form_class, field_args)
+            while len(self._classes) > self.max_size:
+                self._classes.popitem(last=False)
+
+    def invalidate(self, model):
+        """Remove every cached form class generated for `model`."""
+        with self._lock:
+            for key in [k for k in self._classes if k[0] is model]:
+                del self._classes[key]
+
+    def clear(self):
+        with self._lock:
+            self._classes.clear()
+
+
+form_cache = FormCache()
+
+_mixin_bases = {}
+
+def _mixin_base(base_class, mixin, prepend=False):
+    if issubclass(base_class, mixin):
+        return base_class
+    elif base_class is Form:
+        return mixin
+    key = (base_class, mixin, prepend)
+    if key not in _mixin_bases:
+        bases = (mixin, base_class) if prepend else (base_class, mixin)
+        _mixin_bases[key] = type(base_class.__name__, bases, {})
+    return _mixin_bases[key]
+
+
 def model_form(model, base_class=Form, allow_pk=False, only=None, exclude=None,
-               field_args=None, converter=None):
+               field_args=None, converter=None, cache=False, compiled=False,
+               lazy=False, batch_resolve=False):
     """
     Create a wtforms Form for a given Peewee model class::
 
@@ -222,6 +392,45 @@ def model_form(model, base_class=Form, allow_pk=False, only=None, exclude=None,
     :param converter:
         A converter to generate the fields based on the model properties. If
         not set, ``ModelConverter`` is used.
+    :param cache:
+        If ``True``, look the form class up in (and store it in) the shared
+        ``form_cache``. A ``FormCache`` instance may be passed instead. Cached
+        classes are shared, so do not modify them after creation.
+    :param compiled:
+        If ``True``, the form class will also extend
+        ``wtfpeewee.forms.CompiledForm``, which binds fields from prototypes
+        built once per class rather than constructing each field per instance.
+    :param lazy:
+        If ``True``, the form class will also extend ``wtfpeewee.forms.LazyForm``,
+        which binds and processes each field on first use. Cannot be combined
+        with ``compiled``.
+    :param batch_resolve:
+        If ``True``, the form class will also extend
+        ``wtfpeewee.forms.BatchResolveForm``, which loads the submitted values
+        of all query-backed fields with one query per model before validating.
     """
+    if compiled and lazy:
+        raise ValueError('A form cannot be both compiled and lazy.')
+    elif compiled:
+        base_class = _mixin_base(base_class, CompiledForm)
+    elif lazy:
+        base_class = _mixin_base(base_class, LazyForm)
+    if batch_resolve:
+        base_class = _mixin_base(base_class, BatchResolveForm, prepend=True)
+
+    if cache is True:
+        cache = form_cache
+    if cache is not None and cache is not False:
+        key = cache.make_key(model, base_class, allow_pk, only, exclude,
+                             field_args, converter)
+        form_class = cache.get(key)
+        if form_class is None:
+            form_class = model_form(model, base_class, allow_pk, only,
+                                    exclude, field_args, converter)
+            cache.set(key, form_class, field_args)
+        return form_class
+
     field_dict = model_fields(model, allow_pk, only, exclude, field_args, converter)
+    if any(field.kwargs.get('pk_only') for field in field_dict.values()):
+        base_class = _mixin_base(base_class, PkOnlyForm, prepend=True)
     return type(model.__name__ + 'Form', (base_class, ), field_dict)
@@ -0,0 +1,230 @@
+"""
+Pre-generate model forms ahead of time, e.g. in a pre-fork master process,
+and persist the converted field specs so later starts can skip conversion.
+
+    registry = FormRegistry()
+    registry.warm_database(database)
+    registry.save('forms.pickle')
+
+    # on a later start:
+    registry = FormRegistry()
+    registry.load('forms.pickle')
+    EntryForm = registry.get(Entry)
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import types
+try:
+    import copyreg
+except ImportError:
+    import copy_reg as copyreg
+
+from peewee import Model
+from peewee import Node
+from wtforms import Form
+from wtforms.fields.core import UnboundField
+from wtforms.validators import Optional
+
+from wtfpeewee._compat import integer_types
+from wtfpeewee._compat import string_types
+from wtfpeewee.orm import model_fields
+
+
+__all__ = (
+    'FormRegistry',
+)
+
+SPEC_VERSION = 2
+
+
+def _reduce_optional(validator):
+    # Optional stores a lambda, which cannot be pickled, so rebuild it from
+    # its constructor argument instead.
+    strip_whitespace = validator.string_check(u' ') == u''
+    return (Optional, (strip_whitespace,))
+
+copyreg.pickle(Optional, _reduce_optional)
+
+
+def _models_for(database):
+    seen = set()
+    stack = list(Model.__subclasses__())
+    while stack:
+        model = stack.pop(0)
+        if model in seen:
+            continue
+        seen.add(model)
+        stack.extend(model.__subclasses__())
+        bound = model._meta.database
+        if bound is database or getattr(bound, 'obj', None) is database:
+            yield model
+
+
+def _stable_repr(obj, seen=None):
+    # A representation of `obj` which is the same in every process, unlike the
+    # default repr of most objects, which includes their address.
+    if seen is None:
+        seen = set()
+    if isinstance(obj, dict):
+        return '{%s}' % ', '.join(sorted(
+            '%s: %s' % (_stable_repr(k, seen), _stable_repr(v, seen))
+            for k, v in obj.items()))
+    elif isinstance(obj, (list, tuple)):
+        return '%s(%s)' % (type(obj).__name__,
+                           ', '.join(_stable_repr(v, seen) for v in obj))
+    elif isinstance(obj, (set, frozenset)):
+        return '%s(%s)' % (type(obj).__name__,
+                           ', '.join(sorted(_stable_repr(v, seen) for v in obj)))
+    elif obj is None or isinstance(obj, (bool, float, Node) + integer_types +
+                                   string_types):
+        return repr(obj)
+    elif isinstance(obj, type):
+        return '%s.%s' % (obj.__module__, obj.__name__)
+    elif isinstance(obj, types.ModuleType):
+        return obj.__name__
+    code = getattr(obj, '__code__', None)
+    if code is not None:
+        return '%s.%s:%s' % (obj.__module__, obj.__name__, code.co_firstlineno)
+    elif callable(obj) and hasattr(obj, '__self__'):
+        # A builtin function or method, such as datetime.now.
+        return '%s.%s' % (_stable_repr(obj.__self__, seen), obj.__name__)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is None:
+        text = repr(obj)
+        return text if ' at 0x' not in text else '%s()' % _stable_repr(type(obj))
+    elif id(obj) in seen:
+        return '%s()' % _stable_repr(type(obj))
+    seen.add(id(obj))
+    # Private attributes tend to be caches, such as a converter's dispatch
+    # table, which change as the object is used.
+    attrs = dict((k, v) for k, v in attrs.items() if not k.startswith('_'))
+    return '%s(%s)' % (_stable_repr(type(obj)), _stable_repr(attrs, seen))
+
+
+def schema_fingerprint(model):
+    """
+    A cheap summary of a model's fields used to detect stale specs.
+    """
+    return tuple(
+        (field.name, type(field).__module__, type(field).__name__, field.null,
+         _stable_repr(field.default), field.verbose_name, field.help_text,
+         _stable_repr(getattr(field, 'rel_model', None)),
+         _stable_repr(field.choices))
+        for field in model._meta.sorted_fields)
+
+
+def options_digest(options):
+    """
+    A digest of the arguments passed to `model_fields`, used to detect specs
+    which were saved by a registry with different options.
+    """
+    return hashlib.sha1(_stable_repr(options).encode('utf-8')).hexdigest()
+
+
+class FormRegistry(object):
+    """
+    Holds one generated form class per model. Any keyword arguments are
+    passed along to `model_fields` for every model (``allow_pk``, ``only``,
+    ``exclude``, ``field_args`` and ``converter``).
+    """
+    def __init__(self, base_class=Form, **options):
+        self.base_class = base_class
+        self.options = options
+        self._forms = {}
+        self._specs = {}
+
+    def __contains__(self, model):
+        return model in self._forms
+
+    def __len__(self):
+        return len(self._forms)
+
+    def _build(self, model, specs):
+        field_dict = {}
+        for name, field_class, args, kwargs in specs:
+            field_dict[name] = UnboundField(field_class, *args, **kwargs)
+        return type(model.__name__ + 'Form', (self.base_class,), field_dict)
+
+    def register(self, model):
+        """Generate (or regenerate) and return the form class for `model`."""
+        field_dict = model_fields(model, **self.options)
+        specs = [
+            (name, unbound.field_class, unbound.args, unbound.kwargs)
+            for name, unbound in sorted(
+                field_dict.items(), key=lambda item: item[1].creation_counter)]
+        self._specs[model] = specs
+        self._forms[model] = form_class = self._build(model, specs)
+        return form_class
+
+    def get(self, model):
+        """Return the form class for `model`, generating it if necessary."""
+        try:
+            return self._forms[model]
+        except KeyError:
+            return self.register(model)
+
+    def warm(self, models):
+        """Generate form classes for each of the given models."""
+        for model in models:
+            self.get(model)
+
+    def warm_database(self, database):
+        """Generate form classes for every model bound to `database`."""
+        self.warm(_models_for(database))
+
+    def save(self, path):
+        """
+        Write the field specs to `path`. Specs which cannot be pickled (for
+        example ones holding a lambda or a peewee query) are skipped and will be
+        regenerated on load. Returns the list of models which were skipped.
+        """
+        forms = {}
+        skipped = []
+        options = options_digest(self.options)
+        for model, specs in self._specs.items():
+            entry = {'schema': schema_fingerprint(model), 'options': options,
+                     'fields': specs}
+            try:
+                pickle.dumps((model, entry), pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                skipped.append(model)
+            else:
+                forms[model] = entry
+
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump({'version': SPEC_VERSION, 'forms': forms}, fh,
+                            pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return skipped
+
+    def load(self, path):
+        """
+        Load field specs written by `save` and build form classes from them
+        without running the converter. Specs whose model schema has changed
+        since they were saved, or which were saved with different options, are
+        regenerated. Returns the list of models loaded from the file.
+        """
+        with open(path, 'rb') as fh:
+            data = pickle.load(fh)
+        if data.get('version') != SPEC_VERSION:
+            return []
+
+        loaded = []
+        options = options_digest(self.options)
+        for model, entry in data['forms'].items():
+            if (entry['schema'] != schema_fingerprint(model) or
+                    entry['options'] != options):
+                self.register(model)
+                continue
+            self._specs[model] = entry['fields']
+            self._forms[model] = self._build(model, entry['fields'])
+            loaded.append(model)
+        return loaded
@@ -0,0 +1,241 @@
+"""
+Render whole forms from HTML templates compiled once per field.
+
+    renderer = FormRenderer(field_kwargs={'pub_date': {'class': 'wide'}})
+    html = renderer(form)
+
+The first time a field is rendered, its widget is called with placeholder
+values and the output is split into static, pre-escaped fragments. Later
+renders only interpolate the escaped field values, the form prefix and any
+errors. Fields whose
+markup depends on more than their value (for example select fields) are
+rendered through their widget as usual.
+"""
+import re
+import threading
+
+from wtforms import widgets
+from wtforms.widgets import HTMLString
+
+from wtfpeewee._compat import OrderedDict, escape, text_type
+from wtfpeewee.fields import datetime_widget
+
+
+__all__ = (
+    'FieldTemplate',
+    'FormRenderer',
+)
+
+# Appended to each placeholder to find out how the widget escapes the value.
+_PROBE = u'"<&\''
+_ESCAPED_PROBES = (
+    (escape(_PROBE, quote=True), True),
+    (escape(_PROBE, quote=False), False),
+)
+
+
+def _is_leaf(widget):
+    return (isinstance(widget, (widgets.Input, widgets.TextArea)) and
+            not isinstance(widget, widgets.RadioInput))
+
+
+def field_prefix(field):
+    """Return the form prefix that was prepended to the name of `field`."""
+    return field.name[:len(field.name) - len(field.short_name)]
+
+
+def value_sources(field):
+    """
+    Return the fields whose ``_value()`` make up the rendered markup of
+    `field`, or `None` if the field cannot be compiled.
+    """
+    if field.widget is datetime_widget:
+        sources = list(field)
+    else:
+        sources = [field]
+    for source in sources:
+        if not _is_leaf(source.widget):
+            return None
+    return sources
+
+
+class FieldTemplate(object):
+    """
+    The static fragments of a rendered field row. Each slot between a pair of
+    fragments is filled with the escaped value of a source (its index), the
+    form prefix (`PREFIX`) or the rendered errors (`ERRORS`).
+    """
+    PREFIX = -1
+    ERRORS = -2
+
+    def __init__(self, fragments, slots, quotes):
+        self.fragments = fragments
+        self.slots = slots
+        self.quotes = quotes
+
+    def render(self, sources, prefix=u'', errors=u''):
+        fragments = self.fragments
+        prefix = escape(prefix, quote=True)
+        parts = [fragments[0]]
+        for i, slot in enumerate(self.slots):
+            if slot == self.PREFIX:
+                parts.append(prefix)
+            elif slot == self.ERRORS:
+                parts.append(errors)
+            else:
+                parts.append(escape(text_type(sources[slot]._value()),
+                                    quote=self.quotes[i]))
+            parts.append(fragments[i + 1])
+        return u''.join(parts)
+
+    @classmethod
+    def compile(cls, field, sources, render_row):
+        """
+        Call `render_row`, which returns the row markup of `field` with
+        `errors` in place of its errors, while each source's value and the
+        form prefix of every name and derived id are replaced by placeholders,
+        and split the output into a template. Returns `None` if the output
+        cannot be split.
+        """
+        base = u'wtfpeewee%x' % id(field)
+        markers = [u'%sslot%d' % (base, i) for i in range(len(sources))]
+        prefix_marker = base + u'prefix'
+        errors_marker = base + u'errors'
+        prefix = field_prefix(field)
+
+        named = [field] + [source for source in sources if source is not field]
+        saved = [(f.name, f.id, f.label.field_id) for f in named]
+        for f in named:
+            if f.id == f.name:
+                f.id = f.label.field_id = prefix_marker + f.id[len(prefix):]
+            f.name = prefix_marker + f.name[len(prefix):]
+        for source, marker in zip(sources, markers):
+            source._value = lambda marker=marker: marker + _PROBE
+        try:
+            html = text_type(render_row(errors_marker))
+        finally:
+            for source in sources:
+                del source._value
+            for f, (name, id_, field_id) in zip(named, saved):
+                f.name, f.id, f.label.field_id = name, id_, field_id
+
+        pieces = re.split(u'(%s(?:slot\\d+|prefix|errors))' % base, html)
+        fragments = [pieces[0]]
+        slots = []
+        quotes = []
+        for marker, rest in zip(pieces[1::2], pieces[2::2]):
+            quote = None
+            if marker == prefix_marker:
+                slot = cls.PREFIX
+            elif marker == errors_marker:
+                slot = cls.ERRORS
+            else:
+                slot = markers.index(marker)
+                for escaped, quote in _ESCAPED_PROBES:
+                    if rest.startswith(escaped):
+                        break
+                else:
+                    return None
+                rest = rest[len(escaped):]
+            fragments.append(rest)
+            slots.append(slot)
+            quotes.append(quote)
+
+        value_slots = sorted(slot for slot in slots if slot >= 0)
+        if value_slots != list(range(len(sources))) or slots.count(cls.ERRORS) != 1:
+            return None
+        return cls(fragments, slots, quotes)
+
+
+class FormRenderer(object):
+    """
+    Renders every field of a form as ``<p>label widget errors</p>``, or just
+    the widget and errors for hidden fields. Override `row_fragments` and
+    `render_errors` to change the markup, and extend `template_key` if the
+    row markup depends on anything else about the field.
+
+    `field_kwargs` maps field names to the keyword arguments passed to the
+    field's widget, which are compiled into the template. Templates do not
+    depend on the form prefix, and at most `max_templates` of them are kept.
+    """
+    def __init__(self, field_kwargs=None, max_templates=256):
+        self.field_kwargs = field_kwargs or {}
+        self.max_templates = max_templates
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def row_fragments(self, field):
+        """Return the static markup before and after a field's widget."""
+        if isinstance(field.widget, widgets.HiddenInput):
+            return u'', u''
+        return u'<p>%s ' % field.label(), u'</p>'
+
+    def render_errors(self, errors):
+        if isinstance(errors, dict):
+            errors = [error for field_errors in errors.values()
+                      for error in field_errors]
+        if not errors:
+            return u''
+        return u'<ul class="errors">%s</ul>' % u''.join(
+            u'<li>%s</li>' % escape(text_type(error), quote=False)
+            for error in errors)
+
+    def _state(self, sources):
+        return tuple(
+            bool(getattr(source, 'checked', source.data))
+            for source in sources
+            if isinstance(source.widget, widgets.CheckboxInput))
+
+    def template_key(self, field, sources):
+        """
+        Identify the compiled template for `field`. Everything baked into the
+        template besides the values and the form prefix must be part of the
+        key, so that fields of the same name on different forms do not share
+        a template.
+        """
+        render_kw = getattr(field, 'render_kw', None) or {}
+        ids = tuple(source.id != source.name and source.id
+                    for source in [field] + sources)
+        return (field.short_name, ids, type(field), field.widget,
+                text_type(field.label.text), text_type(field.description),
+                repr(sorted(render_kw.items())), self._state(sources))
+
+    def _template(self, key, field, sources, kwargs):
+        with self._lock:
+            try:
+                template = self._templates.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._templates[key] = template
+                return template
+
+        def render_row(errors):
+            before, after = self.row_fragments(field)
+            return before + text_type(field(**kwargs)) + errors + after
+
+        template = FieldTemplate.compile(field, sources, render_row)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self.max_templates:
+                self._templates.popitem(last=False)
+        return template
+
+    def render_field(self, field):
+        kwargs = self.field_kwargs.get(field.short_name, {})
+        errors = self.render_errors(field.errors)
+        sources = value_sources(field)
+        if sources is not None:
+            template = self._template(
+                self.template_key(field, sources), field, sources, kwargs)
+            if template is not None:
+                return template.render(sources, field_prefix(field), errors)
+
+        # Not compilable, render it through the widget.
+        before, after = self.row_fragments(field)
+        return before + text_type(field(**kwargs)) + errors + after
+
+    def render(self, form):
+        return HTMLString(u''.join(self.render_field(field) for field in form))
+
+    __call__ = render
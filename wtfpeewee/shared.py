@@ -0,0 +1,273 @@
+"""
+A choice store shared between processes through memory-mapped files, for
+prefork servers where an in-process `ChoiceCache` would be copied into, and
+warmed by, every worker.
+
+    store = SharedChoiceStore('/var/run/myapp/choices', ttl=600)
+
+    class EntryForm(Form):
+        blog = ModelSelectField(model=Blog, choice_cache=store)
+
+    # in the process responsible for keeping the choices fresh:
+    store.refresh_field(EntryForm().blog)
+
+Each choice list is written to its own file, which readers map read-only
+and decode row by row as the choices are iterated. Files carry a version
+stamp and creation time: readers notice a refreshed list by the file being
+replaced, and with a `ttl` a list older than that is considered stale.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from peewee import Node
+
+from wtfpeewee._compat import integer_types, string_types, text_type
+
+
+__all__ = (
+    'SharedChoiceStore',
+    'SharedChoices',
+)
+
+MAGIC = b'WPC1'
+INT_PKS = 0
+TEXT_PKS = 1
+
+# magic, pk kind, version, created, row count
+HEADER = struct.Struct('<4sB3xQdI')
+PK = struct.Struct('<q')
+OFFSET = struct.Struct('<I')
+PK_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+
+def _stable_name(value):
+    # A representation of a label key which is the same in every process.
+    if isinstance(value, (tuple, list)):
+        return '(%s)' % ','.join(_stable_name(item) for item in value)
+    elif isinstance(value, Node):
+        # Label columns are already part of the choice query's SQL.
+        return 'column'
+    elif value is None or isinstance(value, string_types):
+        return repr(value)
+    code = getattr(value, '__code__', None)
+    if code is not None:
+        return '%s.%s:%s' % (value.__module__, value.__name__, code.co_firstlineno)
+    return repr(value)
+
+
+def _read_version(path):
+    try:
+        with open(path, 'rb') as fh:
+            magic, _, version, _, _ = HEADER.unpack(fh.read(HEADER.size))
+    except (IOError, OSError, struct.error):
+        return 0
+    return version if magic == MAGIC else 0
+
+
+def _pk_kind(pks):
+    if all(isinstance(pk, integer_types) and not isinstance(pk, bool) and
+           PK_RANGE[0] <= pk <= PK_RANGE[1] for pk in pks):
+        return INT_PKS
+    elif all(isinstance(pk, string_types) for pk in pks):
+        return TEXT_PKS
+
+
+def _encode(text):
+    if not isinstance(text, text_type):
+        text = text_type(text)
+    return text.encode('utf-8')
+
+
+class SharedChoices(object):
+    """
+    A read-only sequence of ``(pk, label)`` pairs backed by a memory-mapped
+    store file.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            st = os.fstat(fh.fileno())
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stat_key = (st.st_ino, st.st_mtime, st.st_size)
+        magic, self.kind, self.version, self.created, self.count = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a choice store file.' % path)
+
+        offset = HEADER.size
+        if self.kind == INT_PKS:
+            self._pks_start = offset
+            offset += PK.size * self.count
+            self._stride = 1
+        else:
+            self._stride = 2
+        self._offsets_start = offset
+        self._strings_start = offset + OFFSET.size * (self.count * self._stride + 1)
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, n):
+        start, = OFFSET.unpack_from(self._map, self._offsets_start + OFFSET.size * n)
+        end, = OFFSET.unpack_from(self._map, self._offsets_start + OFFSET.size * (n + 1))
+        base = self._strings_start
+        return self._map[base + start:base + end].decode('utf-8')
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        if self.kind == INT_PKS:
+            pk, = PK.unpack_from(self._map, self._pks_start + PK.size * i)
+            return (pk, self._string(i))
+        return (self._string(2 * i), self._string(2 * i + 1))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    @classmethod
+    def write(cls, path, choices, version):
+        """
+        Atomically replace `path` with a file holding `choices`. Returns
+        `False`, without writing, if the primary keys are neither all
+        integers nor all strings.
+        """
+        choices = list(choices)
+        kind = _pk_kind([pk for pk, _ in choices])
+        if kind is None:
+            return False
+
+        parts = [HEADER.pack(MAGIC, kind, version, time.time(), len(choices))]
+        if kind == INT_PKS:
+            parts.extend(PK.pack(pk) for pk, _ in choices)
+            strings = [_encode(label) for _, label in choices]
+        else:
+            strings = []
+            for pk, label in choices:
+                strings.append(_encode(pk))
+                strings.append(_encode(label))
+
+        position = 0
+        parts.append(OFFSET.pack(0))
+        for string in strings:
+            position += len(string)
+            parts.append(OFFSET.pack(position))
+        parts.extend(strings)
+
+        dirname = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(b''.join(parts))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+
+class SharedChoiceStore(object):
+    """
+    A drop-in replacement for `ChoiceCache` which keeps choice lists in
+    memory-mapped files under `directory`, so they can be written by one
+    process and read by all others.
+
+    A list older than `ttl` seconds (if given) is stale. Missing and stale
+    lists are loaded and written by whichever process reads them first,
+    unless `refresh_on_miss` is `False`, in which case readers load the
+    choices for themselves and leave refreshing to `refresh` or
+    `refresh_field`.
+    """
+    def __init__(self, directory, ttl=None, refresh_on_miss=True, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.refresh_on_miss = refresh_on_miss
+        self.clock = clock
+        self._views = {}
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def make_key(self, query, label_key=None):
+        sql, params = query.sql()
+        digest = hashlib.sha1(_encode(repr((
+            query.database.database, sql, [repr(p) for p in params],
+            _stable_name(label_key))))).hexdigest()
+        return os.path.join(
+            self.directory,
+            '%s-%s.choices' % (query.model_class._meta.db_table, digest))
+
+    def get(self, key):
+        """
+        Return the mapped choices stored under `key`, or `None` if there are
+        none or they are stale. The same object is returned until the file is
+        replaced.
+        """
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        stat_key = (st.st_ino, st.st_mtime, st.st_size)
+        with self._lock:
+            view = self._views.get(key)
+            if view is None or view.stat_key != stat_key:
+                try:
+                    view = self._views[key] = SharedChoices(key)
+                except (IOError, OSError, ValueError, struct.error):
+                    return None
+        if self.ttl and view.created + self.ttl <= self.clock():
+            return None
+        return view
+
+    def version(self, key):
+        """The version stamp of the choices stored under `key`, or `None`."""
+        view = self.get(key)
+        return view.version if view is not None else None
+
+    def set(self, key, model, choices):
+        """
+        Write `choices` under `key`, returning `False` if their primary keys
+        cannot be stored.
+        """
+        return SharedChoices.write(key, choices, _read_version(key) + 1)
+
+    def get_choices(self, query, load_choices, label_key=None):
+        key = self.make_key(query, label_key)
+        choices = self.get(key)
+        if choices is not None:
+            return choices
+        choices = tuple(load_choices())
+        if self.refresh_on_miss and self.set(key, query.model_class, choices):
+            return self.get(key) or choices
+        return choices
+
+    def refresh(self, query, load_choices, label_key=None):
+        """Load the choices for `query` and write them to the store."""
+        key = self.make_key(query, label_key)
+        return self.set(key, query.model_class, load_choices())
+
+    def refresh_field(self, field):
+        """Refresh the choices of a bound query-backed select field."""
+        query = field.choice_query()
+        return self.refresh(query, lambda: field.load_choice_pairs(query), field._label_key)
+
+    def invalidate(self, model):
+        """Remove every choice list built from a query on `model`."""
+        self._remove('%s-' % model._meta.db_table)
+
+    def clear(self):
+        self._remove('')
+
+    def _remove(self, prefix):
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith('.choices'):
+                try:
+                    os.unlink(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
@@ -1,13 +1,39 @@
+import base64
 import datetime
+import json
+import os
 import sys
+import tempfile
 import unittest
 
 from peewee import *
 from wtforms import fields as wtfields
 from wtforms.form import Form as WTForm
+from wtforms.validators import Length
+from wtforms.validators import Optional
 from wtforms.validators import Regexp
+from wtforms.validators import ValidationError
+from wtfpeewee._compat import escape
 from wtfpeewee.fields import *
+from wtfpeewee.bulk import bulk_save
+from wtfpeewee.cache import ChoiceCache
+from wtfpeewee.choices import CompactChoices
+from wtfpeewee.cache import FragmentCache
+from wtfpeewee.cache import IdentityMap
+from wtfpeewee.fields import choice_index
+from wtfpeewee.fields import generate_datetime_form
+from wtfpeewee.forms import BatchResolveForm
+from wtfpeewee.forms import CompiledForm
+from wtfpeewee.forms import PkOnlyForm
+from wtfpeewee.orm import FormCache
+from wtfpeewee.orm import ModelConverter
+from wtfpeewee.orm import model_fields
 from wtfpeewee.orm import model_form
+from wtfpeewee import registry as registry_module
+from wtfpeewee.registry import FormRegistry
+from wtfpeewee.render import FormRenderer
+from wtfpeewee.shared import SharedChoiceStore
+from wtfpeewee.timing import FieldTimer
 from wtfpeewee._compat import PY2
 
 
@@ -82,6 +108,26 @@ class FakePost(dict):
         return [val]
 
 
+class QueryLog(object):
+    """Records the SQL executed against `test_db` while active."""
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        original = self._original = test_db.execute_sql
+        def execute_sql(sql, params=None, *args, **kwargs):
+            self.queries.append((sql, params))
+            return original(sql, params, *args, **kwargs)
+        test_db.execute_sql = execute_sql
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        del test_db.execute_sql
+
+    def __len__(self):
+        return len(self.queries)
+
+
 class WTFPeeweeTestCase(unittest.TestCase):
     def setUp(self):
         NullEntry.drop_table(True)
@@ -157,6 +203,1091 @@ class WTFPeeweeTestCase(unittest.TestCase):
         #form = NonIntPKForm(FakePost({'id': 'b', 'value': 'C'}))
         #self.assertFalse(form.validate())
 
+    def test_form_cache(self):
+        cache = FormCache(max_size=2)
+        BlogFormA = model_form(Blog, cache=cache)
+        self.assertTrue(model_form(Blog, cache=cache) is BlogFormA)
+        self.assertFalse(model_form(Blog) is BlogFormA)
+
+        # only/exclude ordering does not matter, but their contents do.
+        EntryFormA = model_form(Entry, only=['title', 'blog'], cache=cache)
+        self.assertTrue(model_form(Entry, only=('blog', 'title'), cache=cache) is EntryFormA)
+        self.assertEqual(sorted(EntryFormA()._fields.keys()), ['blog', 'title'])
+
+        # field_args and converters are part of the key.
+        args = {'title': {'validators': [Regexp('test')]}}
+        BlogFormB = model_form(Blog, field_args=args, cache=cache)
+        self.assertFalse(BlogFormB is BlogFormA)
+        self.assertTrue(model_form(Blog, field_args=args, cache=cache) is BlogFormB)
+        converter = ModelConverter()
+        self.assertFalse(model_form(Blog, field_args=args, converter=converter, cache=cache) is BlogFormB)
+
+        # equivalent validators built on every call (e.g. in a view) share a
+        # key, and different ones do not.
+        def view_form(max_length):
+            return model_form(Blog, field_args={'title': {'validators': [
+                Length(max=max_length), Optional()]}}, cache=cache)
+        self.assertTrue(view_form(10) is view_form(10))
+        self.assertFalse(view_form(10) is view_form(20))
+
+        # the cache is bounded and least-recently-used entries are evicted.
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(model_form(Blog, cache=cache) is BlogFormA)
+
+        BlogFormC = model_form(Blog, cache=cache)
+        cache.invalidate(Entry)
+        self.assertTrue(model_form(Blog, cache=cache) is BlogFormC)
+        cache.invalidate(Blog)
+        self.assertFalse(model_form(Blog, cache=cache) is BlogFormC)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_converter_dispatch(self):
+        class SlugField(CharField):
+            pass
+
+        class AuditModel(TestModel):
+            slug = SlugField()
+            created = TimestampField()
+            counter = BigIntegerField()
+
+        converter = ModelConverter()
+        AuditForm = model_form(AuditModel, allow_pk=True, converter=converter)
+        form = AuditForm()
+        self.assertTrue(isinstance(form.id, wtfields.HiddenField))
+        self.assertTrue(isinstance(form.slug, wtfields.TextField))
+        self.assertTrue(isinstance(form.created, WPDateTimeField))
+        self.assertTrue(isinstance(form.counter, wtfields.IntegerField))
+
+        # resolution is cached per peewee field class.
+        self.assertEqual(converter.get_converter(AuditModel.slug)[0], CharField)
+        self.assertTrue(SlugField in converter._dispatch)
+
+        # user-supplied converters take precedence over the defaults.
+        converter = ModelConverter(additional={
+            CharField: lambda model, field, **kw: (field.name, wtfields.PasswordField(**kw))})
+        form = model_form(AuditModel, converter=converter)()
+        self.assertTrue(isinstance(form.slug, wtfields.PasswordField))
+
+    def test_compiled_form(self):
+        CompiledEntryForm = model_form(Entry, compiled=True)
+        form = CompiledEntryForm()
+        self.assertEqual(sorted(form._fields.keys()), ['blog', 'content', 'pub_date', 'title'])
+        self.assertTrue(isinstance(form.pub_date.data, datetime.datetime))
+        self.assertEqual(form.blog.data, None)
+        self.assertEqual(form.title.label.text, 'Wacky title')
+        self.assertTrue(form.title.flags.required)
+
+        form = CompiledEntryForm(obj=self.entry_a1)
+        self.assertEqual(form.data, EntryForm(obj=self.entry_a1).data)
+        self.assertTrue(form.validate())
+
+        form = CompiledEntryForm(FakePost({
+            'e-title': 'new entry',
+            'e-content': 'some content',
+            'e-pub_date-date': '2011-02-01',
+            'e-pub_date-time': '00:00:00',
+            'e-blog': self.blog_b.get_id(),
+        }), prefix='e')
+        self.assertEqual(form.title.name, 'e-title')
+        self.assertEqual(form.title.id, 'e-title')
+        self.assertTrue(form.validate())
+        entry = Entry()
+        form.populate_obj(entry)
+        self.assertEqual(entry.blog, self.blog_b)
+        self.assertEqual(entry.pub_date, datetime.datetime(2011, 2, 1))
+
+        # instances do not share field state.
+        other = CompiledEntryForm(FakePost({'e-title': ''}), prefix='e')
+        self.assertFalse(other.validate())
+        self.assertTrue('title' in other.errors)
+        self.assertEqual(form.errors, {})
+        self.assertFalse(other.title is form.title)
+
+        # inline validators and custom base classes are honored.
+        class BaseBlogForm(WTForm):
+            def validate_title(self, field):
+                if field.data == 'bad':
+                    raise ValidationError('bad title')
+
+        CompiledBlogForm = model_form(Blog, base_class=BaseBlogForm, compiled=True)
+        self.assertTrue(issubclass(CompiledBlogForm, BaseBlogForm))
+        self.assertFalse(CompiledBlogForm(FakePost({'title': 'bad'})).validate())
+        self.assertTrue(CompiledBlogForm(FakePost({'title': 'good'})).validate())
+
+        # fields without a value resolve their own default, as in wtforms.
+        class Sub(WTForm):
+            title = wtfields.TextField()
+
+        class FormFieldForm(CompiledForm):
+            sub = wtfields.FormField(Sub, default=Blog(title='default'))
+
+        form = FormFieldForm()
+        self.assertEqual(form.sub.title.data, 'default')
+        blog = Blog()
+        form.populate_obj(blog)
+        self.assertEqual(blog.sub.title, 'default')
+
+        # fields with per-instance state can opt out of being copied.
+        class HistoryField(wtfields.TextField):
+            compilable = False
+
+            def __init__(self, *args, **kwargs):
+                super(HistoryField, self).__init__(*args, **kwargs)
+                self.history = []
+
+            def process_formdata(self, valuelist):
+                super(HistoryField, self).process_formdata(valuelist)
+                self.history.append(self.data)
+
+        class HistoryForm(CompiledForm):
+            title = HistoryField()
+            content = wtfields.TextField()
+
+        a = HistoryForm(FakePost({'h-title': 'a'}), prefix='h')
+        b = HistoryForm(FakePost({'h-title': 'b'}), prefix='h')
+        self.assertEqual(a.title.history, ['a'])
+        self.assertEqual(b.title.history, ['b'])
+        self.assertEqual(b.title.name, 'h-title')
+        self.assertEqual(list(b._fields.keys()), ['title', 'content'])
+
+    def test_bulk_save(self):
+        forms = [BlogForm(FakePost({'title': 'new %s' % i})) for i in range(3)]
+        forms.extend([
+            BlogForm(FakePost({'title': 'a edited'}), obj=self.blog_a),
+            BlogForm(FakePost({'title': 'b edited'}), obj=self.blog_b),
+        ])
+        self.assertTrue(all(form.validate() for form in forms))
+
+        with QueryLog() as log:
+            blogs = bulk_save(Blog, forms, [None, None, None, self.blog_a, self.blog_b])
+        # one insert_many, one CASE-based update.
+        self.assertEqual(len([q for q, _ in log.queries if q.startswith(('INSERT', 'UPDATE'))]), 2)
+        self.assertEqual(len(blogs), 5)
+        self.assertEqual(
+            sorted(b.title for b in Blog.select()),
+            ['a edited', 'b edited', 'new 0', 'new 1', 'new 2'])
+
+        # rows receiving identical values are grouped into one UPDATE.
+        EntryTitleForm = model_form(Entry, only=('title',))
+        entries = [self.entry_a1, self.entry_a2, self.entry_b1]
+        forms = [EntryTitleForm(FakePost({'title': 'same'}), obj=e) for e in entries]
+        with QueryLog() as log:
+            bulk_save(Entry, forms, entries)
+        updates = [q for q, _ in log.queries if q.startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse('CASE' in updates[0])
+        self.assertEqual([e.title for e in Entry.select().order_by(Entry.pk)], ['same'] * 3)
+        self.assertEqual(Entry.get(Entry.pk == self.entry_a1.pk).content, 'a1 content')
+
+        # rows are chunked according to the parameter limit.
+        forms = [BlogForm(FakePost({'title': 'bulk %s' % i})) for i in range(1200)]
+        with QueryLog() as log:
+            bulk_save(Blog, forms)
+        self.assertEqual(len([q for q, _ in log.queries if q.startswith('INSERT')]), 2)
+        self.assertEqual(Blog.select().count(), 1205)
+
+    def test_lazy_form(self):
+        LazyEntryForm = model_form(Entry, lazy=True)
+        form = LazyEntryForm(obj=self.entry_a1)
+        self.assertEqual(list(form._fields), ['blog', 'title', 'content', 'pub_date'])
+        self.assertFalse(form._fields.is_bound('blog'))
+
+        # attribute access binds and processes only the requested field.
+        self.assertEqual(form.title.data, 'a1')
+        self.assertTrue(form._fields.is_bound('title'))
+        self.assertFalse(form._fields.is_bound('blog'))
+        self.assertTrue(form['title'] is form.title)
+
+        # validation and data access bind the rest.
+        self.assertTrue(form.validate())
+        self.assertTrue(form._fields.is_bound('blog'))
+        self.assertEqual(form.data, EntryForm(obj=self.entry_a1).data)
+
+        form = LazyEntryForm(FakePost({
+            'title': 'new entry',
+            'content': 'some content',
+            'pub_date-date': '2011-02-01',
+            'pub_date-time': '00:00:00',
+            'blog': self.blog_b.get_id(),
+        }))
+        self.assertEqual([field.name for field in form], ['blog', 'title', 'content', 'pub_date'])
+        self.assertTrue(form.validate())
+        entry = Entry()
+        form.populate_obj(entry)
+        self.assertEqual(entry.blog, self.blog_b)
+        self.assertEqual(entry.title, 'new entry')
+
+        form = LazyEntryForm(FakePost({'title': ''}))
+        self.assertFalse(form.validate())
+        self.assertTrue('title' in form.errors)
+
+        self.assertRaises(ValueError, model_form, Entry, lazy=True, compiled=True)
+
+    def test_field_timer(self):
+        calls = []
+        with FieldTimer(lambda field, phase, elapsed: calls.append((field.name, phase))) as timer:
+            form = EntryForm(FakePost({
+                'title': 'new entry',
+                'content': 'some content',
+                'pub_date-date': '2011-02-01',
+                'pub_date-time': '00:00:00',
+                'blog': self.blog_b.get_id(),
+            }))
+            self.assertTrue(form.validate())
+            form.blog()
+            form.populate_obj(Entry())
+
+        phases = set(phase for name, phase in timer.timings if name == 'blog')
+        self.assertEqual(phases, set([
+            'process', 'process_formdata', 'pre_validate', 'validators',
+            'render', 'populate_obj']))
+        self.assertTrue(('pub_date', 'process') in timer.timings)
+        self.assertTrue(('pub_date-time', 'process_formdata') in timer.timings)
+        self.assertTrue(all(elapsed >= 0 for elapsed in timer.timings.values()))
+
+        # overridden methods calling their parents are only reported once.
+        self.assertEqual(calls.count(('blog', 'render')), 1)
+
+        # fields are restored once the timer exits.
+        self.assertFalse(hasattr(SelectQueryField.__call__, '_wtfpeewee_timed'))
+        self.assertFalse(hasattr(wtfields.Field.process, '_wtfpeewee_timed'))
+
+    def test_form_registry(self):
+        registry = FormRegistry()
+        registry.warm_database(test_db)
+        for model in (Blog, Entry, NullEntry, ChoicesModel, NonIntPKModel):
+            self.assertTrue(model in registry)
+        self.assertTrue(registry.get(Blog) is registry.get(Blog))
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            # models which cannot be pickled themselves are skipped.
+            class LocalModel(TestModel):
+                name = CharField()
+
+            registry.get(LocalModel)
+            skipped = registry.save(path)
+            self.assertTrue(LocalModel in skipped)
+            self.assertFalse(Entry in skipped)
+
+            def failing_model_fields(*args, **kwargs):
+                raise AssertionError('converter should not be used')
+
+            registry_module.model_fields = failing_model_fields
+            try:
+                loaded_registry = FormRegistry()
+                loaded = loaded_registry.load(path)
+            finally:
+                registry_module.model_fields = model_fields
+
+            # specs saved with other options, or for a changed field, are
+            # regenerated.
+            excluding = FormRegistry(exclude=['content'])
+            self.assertFalse(Entry in excluding.load(path))
+            self.assertFalse('content' in excluding.get(Entry)()._fields)
+
+            Entry.title.verbose_name = 'Title'
+            try:
+                changed = FormRegistry()
+                self.assertFalse(Entry in changed.load(path))
+                self.assertTrue(Blog in changed.load(path))
+                self.assertEqual(changed.get(Entry)().title.label.text, 'Title')
+            finally:
+                Entry.title.verbose_name = 'Wacky title'
+        finally:
+            os.unlink(path)
+
+        self.assertTrue(Entry in loaded)
+        LoadedEntryForm = loaded_registry.get(Entry)
+        self.assertEqual(
+            list(LoadedEntryForm()._fields.keys()),
+            list(EntryForm()._fields.keys()))
+
+        form = LoadedEntryForm(obj=self.entry_a1)
+        self.assertEqual(form.data, EntryForm(obj=self.entry_a1).data)
+        self.assertTrue(form.validate())
+        self.assertFalse(LoadedEntryForm(FakePost({'title': ''})).validate())
+
+    def test_choice_cache(self):
+        now = [1000]
+        cache = ChoiceCache(ttl=60, max_size=10, clock=lambda: now[0])
+
+        class TestForm(WTForm):
+            blog = ModelSelectField(model=Blog, choice_cache=cache)
+            titled = SelectQueryField(query=Blog.select(), get_label='title', choice_cache=cache)
+
+        expected = [(self.blog_a.id, 'a', False), (self.blog_b.id, 'b', True)]
+        form = TestForm(obj=self.entry_b1)
+        with QueryLog() as log:
+            self.assertEqual(list(form.blog.iter_choices()), expected)
+            self.assertEqual(list(form.blog.iter_choices()), expected)
+        self.assertEqual(len(log), 1)
+
+        # the label getter is part of the key.
+        with QueryLog() as log:
+            list(form.titled.iter_choices())
+            list(TestForm().titled.iter_choices())
+        self.assertEqual(len(log), 1)
+        self.assertEqual(len(cache), 2)
+
+        # entries expire after the ttl.
+        now[0] += 61
+        with QueryLog() as log:
+            list(form.blog.iter_choices())
+        self.assertEqual(len(log), 1)
+
+        Blog.create(title='c')
+        self.assertEqual(len(list(form.blog.iter_choices())), 2)
+        cache.invalidate(Blog)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(list(form.blog.iter_choices())), 3)
+
+    def test_datetime_parsing(self):
+        class TestForm(WTForm):
+            date = WPDateField()
+            time = WPTimeField()
+
+        def strptime(value, formats):
+            for format in formats:
+                try:
+                    return datetime.datetime.strptime(value, format)
+                except ValueError:
+                    pass
+
+        for value in ('12:30', '12:30:15', '9:05', '9:5:1', '23:59:59', '24:00',
+                      '12:60', '12:30:60', '12:30 ', ' 12:30', '1230', '', 'x'):
+            form = TestForm(FakePost({'time': value}))
+            parsed = strptime(value, WPTimeField.formats)
+            self.assertEqual(form.time.data, parsed and parsed.time())
+
+        for value in ('2011-01-02', '2011-1-2', '2011-02-30', '2011-13-01',
+                      '11-01-02', '2011-01-02 ', '2011/01/02'):
+            form = TestForm(FakePost({'date': value}))
+            parsed = strptime(value, ['%Y-%m-%d'])
+            self.assertEqual(form.date.data, parsed and parsed.date())
+            self.assertEqual(form.validate(), parsed is not None)
+
+        # subform classes are shared by fields with the same validators.
+        validators = [Regexp('.')]
+        self.assertTrue(generate_datetime_form(validators) is
+                        generate_datetime_form(list(validators)))
+        self.assertFalse(generate_datetime_form(validators) is
+                         generate_datetime_form([Regexp('.')]))
+        EntryForm = model_form(Entry)
+        self.assertTrue(EntryForm().pub_date.form_class is EntryForm().pub_date.form_class)
+
+    def test_flat_datetime_field(self):
+        class FlatConverter(ModelConverter):
+            defaults = dict(ModelConverter.defaults)
+            defaults[DateTimeField] = FlatDateTimeField
+
+        NestedForm = model_form(Entry)
+        FlatForm = model_form(Entry, converter=FlatConverter())
+        self.assertTrue(isinstance(FlatForm().pub_date, FlatDateTimeField))
+
+        for obj in (self.entry_a1, Entry(blog=self.blog_b, pub_date=datetime.datetime(2011, 1, 2, 3, 4, 5))):
+            nested = NestedForm(obj=obj)
+            flat = FlatForm(obj=obj)
+            self.assertEqual(flat.pub_date(), nested.pub_date())
+            self.assertEqual(flat.pub_date.data, nested.pub_date.data)
+            self.assertEqual(flat.pub_date.date.name, 'pub_date-date')
+
+        for date, time in (('2011-01-02', '03:04'), ('2011-01-02', ''),
+                           ('', ''), ('bad', '03:04'), ('2011-01-02', 'bad')):
+            post = FakePost({'pub_date-date': date, 'pub_date-time': time})
+            nested = NestedForm(post)
+            flat = FlatForm(post)
+            self.assertEqual(flat.validate(), nested.validate())
+            self.assertEqual(flat.errors.get('pub_date'), nested.errors.get('pub_date'))
+            self.assertEqual(flat.pub_date.data, nested.pub_date.data)
+
+        flat = FlatForm(FakePost({'pub_date-date': '2011-01-02', 'pub_date-time': '03:04'}))
+        entry = Entry()
+        flat.populate_obj(entry)
+        self.assertEqual(entry.pub_date, datetime.datetime(2011, 1, 2, 3, 4))
+
+        # compiled forms get their own subfields, named after their prefix.
+        CompiledFlatForm = model_form(Entry, converter=FlatConverter(), compiled=True)
+        a = CompiledFlatForm(FakePost({'pub_date-date': '2011-01-02', 'pub_date-time': '03:04'}))
+        b = CompiledFlatForm(FakePost({'pub_date-date': '2012-05-06', 'pub_date-time': '07:08'}))
+        self.assertFalse(a.pub_date.date is b.pub_date.date)
+        self.assertEqual(a.pub_date.data, datetime.datetime(2011, 1, 2, 3, 4))
+        self.assertEqual(b.pub_date.data, datetime.datetime(2012, 5, 6, 7, 8))
+
+        prefixed = CompiledFlatForm(
+            FakePost({'x-pub_date-date': '2013-01-01', 'x-pub_date-time': '10:00'}), prefix='x')
+        self.assertEqual(prefixed.pub_date.date.name, 'x-pub_date-date')
+        self.assertEqual(prefixed.pub_date.data, datetime.datetime(2013, 1, 1, 10, 0))
+
+    def test_form_renderer(self):
+        class TestForm(WTForm):
+            title = wtfields.TextField()
+            content = wtfields.TextAreaField()
+            published = wtfields.BooleanField()
+            blog = SelectQueryField(query=Blog.select())
+            hidden = HiddenQueryField(query=Blog.select())
+            pub_date = WPDateTimeField()
+            flat_date = FlatDateTimeField()
+
+        field_kwargs = {'pub_date': {'class': 'wide'}, 'title': {'size': 10}}
+        renderer = FormRenderer(field_kwargs)
+
+        def expected(form):
+            html = []
+            for field in form:
+                kwargs = field_kwargs.get(field.short_name, {})
+                if field.short_name != 'hidden':
+                    html.append('<p>%s ' % field.label())
+                html.append(field(**kwargs))
+                errors = field.errors
+                if isinstance(errors, dict):
+                    errors = [e for errs in errors.values() for e in errs]
+                if errors:
+                    html.append('<ul class="errors">%s</ul>' % ''.join(
+                        '<li>%s</li>' % e for e in errors))
+                if field.short_name != 'hidden':
+                    html.append('</p>')
+            return ''.join(html)
+
+        posts = (
+            {'title': 'a "<b>\' & c', 'content': '</textarea>&', 'published': 'y',
+             'blog': self.blog_b.id, 'hidden': self.blog_a.id,
+             'pub_date-date': '2011-01-02', 'pub_date-time': '03:04',
+             'flat_date-date': '<bad>', 'flat_date-time': ''},
+            {'title': 'x', 'hidden': '', 'pub_date-date': '', 'pub_date-time': 'bad'},
+        )
+        for post in posts:
+            form = TestForm(FakePost(post))
+            form.validate()
+            self.assertEqual(renderer(form), expected(form))
+            self.assertEqual(renderer(form), expected(form))
+
+        # text, textarea, both checkbox states, hidden and both datetimes.
+        self.assertEqual(len([t for t in renderer._templates.values() if t]), 7)
+        self.assertTrue('size="10"' in renderer(TestForm()))
+        self.assertEqual(renderer(TestForm()), expected(TestForm()))
+
+        # fields of the same name on other forms get their own templates.
+        class OtherForm(WTForm):
+            title = wtfields.TextField('Blog title', render_kw={'class': 'wide'})
+
+        class DescribedForm(WTForm):
+            title = wtfields.TextField('Title', description='Shown')
+
+        for form_class in (OtherForm, DescribedForm):
+            form = form_class()
+            self.assertEqual(renderer.render_field(form.title),
+                             '<p>%s %s</p>' % (form.title.label(), form.title(size=10)))
+        self.assertTrue('class="wide"' in renderer(OtherForm()))
+        self.assertEqual(renderer(TestForm()), expected(TestForm()))
+
+        # prefixed forms reuse the templates of the unprefixed form.
+        compiled = len(renderer._templates)
+        for prefix in ('row-0', 'row-1', 'a"<b>'):
+            post = dict(('%s-%s' % (prefix, k), v) for k, v in posts[0].items())
+            form = TestForm(FakePost(post), prefix=prefix)
+            form.validate()
+            self.assertTrue('name="%s-title"' % escape(prefix, quote=True) in renderer(form))
+            self.assertEqual(renderer(form), expected(form))
+        self.assertEqual(len(renderer._templates), compiled)
+
+        # explicit ids are not prefixed.
+        class IdForm(WTForm):
+            title = wtfields.TextField(id='main-title')
+
+        for prefix in ('', 'row-0'):
+            form = IdForm(prefix=prefix)
+            self.assertEqual(renderer.render_field(form.title),
+                             '<p>%s %s</p>' % (form.title.label(), form.title(size=10)))
+
+        bounded = FormRenderer(field_kwargs, max_templates=2)
+        self.assertEqual(bounded(TestForm(prefix='x')), expected(TestForm(prefix='x')))
+        self.assertEqual(len(bounded._templates), 2)
+
+    def test_cached_select_widget(self):
+        cache = ChoiceCache()
+        fragments = FragmentCache()
+
+        class TestForm(WTForm):
+            blog = ModelSelectField(model=Blog, allow_blank=True, choice_cache=cache,
+                                    widget=CachedSelectWidget(fragment_cache=fragments))
+            blogs = ModelSelectMultipleField(model=Blog, choice_cache=cache,
+                                             widget=CachedSelectWidget(True, fragments))
+
+        def rendered(form, **kwargs):
+            return (form.blog(**kwargs), form.blogs(**kwargs))
+
+        def expected(form, **kwargs):
+            return (ChosenSelectWidget()(form.blog, **kwargs),
+                    ChosenSelectWidget(True)(form.blogs, **kwargs))
+
+        for obj in (None, Entry(blog=self.blog_b, blogs=[self.blog_a, self.blog_b])):
+            form = TestForm(obj=obj)
+            self.assertEqual(rendered(form), expected(form))
+            self.assertEqual(rendered(form, class_='x'), expected(form, class_='x'))
+        self.assertEqual(len(fragments), 4)
+        self.assertTrue('<option selected value="__None">' in TestForm().blog())
+
+        # a cached fragment is reused without iterating the choices.
+        form = TestForm(obj=Entry(blog=self.blog_a))
+        form.blog.iter_choices = None
+        self.assertTrue('<option selected value="%s">a</option>' % self.blog_a.id in form.blog())
+
+        # invalidating the choice cache changes the version.
+        Blog.create(title='<c>')
+        cache.invalidate(Blog)
+        form = TestForm()
+        self.assertTrue('&lt;c&gt;' in form.blog())
+        self.assertEqual(rendered(form), expected(form))
+
+    def test_shared_choice_store(self):
+        import shutil
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        now = [1000.]
+        writer = SharedChoiceStore(directory)
+        reader = SharedChoiceStore(directory, ttl=60, refresh_on_miss=False,
+                                   clock=lambda: now[0])
+
+        def make_form(store):
+            class TestForm(WTForm):
+                blog = ModelSelectField(model=Blog, choice_cache=store)
+                titled = SelectQueryField(query=Blog.select(), label_columns='title',
+                                          choice_cache=store)
+                entry = ModelSelectField(model=NonIntPKModel, get_label='value', choice_cache=store)
+            return TestForm(obj=self.entry_b1, titled=self.blog_b)
+
+        NonIntPKModel.create(id=u'\xe9', value='x')
+        expected = [(self.blog_a.id, 'a', False), (self.blog_b.id, 'b', True)]
+
+        # a reader without a stored list loads the choices itself.
+        form = make_form(reader)
+        with QueryLog() as log:
+            self.assertEqual(list(form.blog.iter_choices()), expected)
+        self.assertEqual(len(log), 1)
+        self.assertEqual(os.listdir(directory), [])
+
+        form = make_form(writer)
+        for field in form:
+            writer.refresh_field(field)
+        self.assertEqual(len(os.listdir(directory)), 3)
+
+        form = make_form(reader)
+        with QueryLog() as log:
+            self.assertEqual(list(form.blog.iter_choices()), expected)
+            self.assertEqual(list(form.titled.iter_choices()), expected)
+            self.assertEqual(list(form.entry.iter_choices()), [(u'\xe9', 'x', False)])
+        self.assertEqual(len(log), 0)
+        key = reader.make_key(Blog.select())
+        self.assertEqual(reader.version(key), 1)
+        self.assertTrue(reader.get(key) is reader.get(key))
+
+        # readers see a refreshed list and its new version.
+        Blog.create(title='c')
+        writer.refresh_field(make_form(writer).blog)
+        self.assertEqual(reader.version(key), 2)
+        self.assertEqual(len(list(form.blog.iter_choices())), 3)
+
+        # lists older than the ttl are stale.
+        now[0] = reader.get(key).created + 61
+        self.assertEqual(reader.get(key), None)
+
+        writer.invalidate(Blog)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertEqual(len(list(make_form(writer).blog.iter_choices())), 3)
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_compact_choices(self):
+        pairs = [(5, u'five'), (-2, u'minus \xe9'), (9, u''), (1, u'one')]
+        choices = CompactChoices.from_pairs(pairs)
+        self.assertEqual(list(choices), pairs)
+        self.assertEqual(len(choices), 4)
+        self.assertEqual(choices[1], pairs[1])
+        self.assertEqual(choices[-1], pairs[-1])
+        self.assertEqual([choices.index_of(pk) for pk, _ in pairs], [0, 1, 2, 3])
+        self.assertEqual(choices.label_for(-2), u'minus \xe9')
+        self.assertFalse(choices.has_pk(3))
+        self.assertFalse(choices.has_pk('5'))
+        self.assertEqual(CompactChoices.from_pairs([('a', 'b')]), None)
+        self.assertEqual(CompactChoices.from_pairs([(2 ** 64, 'b')]), None)
+
+        cache = ChoiceCache(compact=True)
+
+        class TestForm(WTForm):
+            blog = ModelSelectField(model=Blog, choice_cache=cache, pk_only=True)
+            blogs = ModelSelectMultipleField(model=Blog, choice_cache=cache)
+            entry = ModelSelectField(model=Entry, label_columns='title', choice_cache=cache)
+
+        form = TestForm(FakePost({'blog': self.blog_b.id, 'blogs': [self.blog_a.id]}),
+                        entry=self.entry_a2)
+        with QueryLog() as log:
+            self.assertEqual(list(form.blog.iter_choices()), [
+                (self.blog_a.id, 'a', False), (self.blog_b.id, 'b', True)])
+            self.assertEqual(list(form.entry.iter_choices()), [
+                (self.entry_a1.pk, 'a1', False),
+                (self.entry_a2.pk, 'a2', True),
+                (self.entry_b1.pk, 'b1', False)])
+        self.assertEqual(len(log), 2)
+        self.assertTrue(isinstance(cache.get(cache.make_key(Blog.select())), CompactChoices))
+
+        # pks are validated against the cached choices.
+        with QueryLog() as log:
+            self.assertTrue(form.validate())
+        self.assertEqual(len(log), 1)  # loading blogs' instances.
+
+        form = TestForm(FakePost({'blog': 1000}), data={'blogs': [Blog(id=1000)]},
+                        entry=self.entry_a2)
+        with QueryLog() as log:
+            self.assertFalse(form.validate())
+        self.assertEqual(len(log), 0)
+        self.assertEqual(form.errors, {
+            'blog': ['Not a valid choice'],
+            'blogs': ['Not a valid choice']})
+
+    def test_choice_cache_signals(self):
+        from playhouse.signals import Model as SignalModel
+
+        class Tag(SignalModel):
+            name = CharField()
+
+            class Meta:
+                database = test_db
+
+        class Label(SignalModel):
+            name = CharField()
+
+            class Meta:
+                database = test_db
+
+        Tag.create_table()
+        Label.create_table()
+        cache = ChoiceCache()
+        try:
+            # a cache can follow several senders.
+            cache.connect_signals(sender=Tag)
+            cache.connect_signals(sender=Label)
+            Tag.create(name='t1')
+            Label.create(name='l1')
+            TagForm = type('TagForm', (WTForm,), {
+                'tag': ModelSelectField(model=Tag, choice_cache=cache),
+                'label': ModelSelectField(model=Label, choice_cache=cache)})
+            form = TagForm()
+            self.assertEqual(len(list(form.tag.iter_choices())), 1)
+            self.assertEqual(len(list(form.label.iter_choices())), 1)
+            Tag.create(name='t2')
+            Label.create(name='l2')
+            self.assertEqual(len(list(form.tag.iter_choices())), 2)
+            self.assertEqual(len(list(form.label.iter_choices())), 2)
+
+            cache.disconnect_signals(sender=Label)
+            Label.create(name='l3')
+            self.assertEqual(len(list(form.label.iter_choices())), 2)
+        finally:
+            cache.disconnect_signals(sender=Tag)
+            Tag.drop_table()
+            Label.drop_table()
+
+    def test_streaming_select(self):
+        for i in range(5):
+            Blog.create(title='<blog %s>' % i)
+
+        class TestForm(WTForm):
+            blog = ModelSelectField(model=Blog, allow_blank=True)
+            streamed = ModelSelectField(model=Blog, widget=StreamingSelectWidget(chunk_size=3))
+            multiple = SelectMultipleQueryField(query=Blog.select())
+
+        form = TestForm(FakePost({'blog': self.blog_b.id, 'streamed': self.blog_b.id, 'multiple': [self.blog_a.id]}))
+
+        chunks = list(form.blog.stream())
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(u''.join(chunks), form.blog())
+        self.assertTrue(u'<option selected value="%s">b</option>' % self.blog_b.id in chunks[1])
+        self.assertTrue(u'&lt;blog 0&gt;' in chunks[1])
+
+        # 7 options in chunks of 3, plus the opening tag.
+        chunks = list(form.streamed.stream(class_='big'))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[0], u'<select class="big" data-role="chosen" id="streamed" name="streamed">')
+        self.assertEqual(u''.join(chunks), form.streamed(class_='big'))
+
+        self.assertEqual(u''.join(form.multiple.stream()), form.multiple())
+
+    def test_remote_select(self):
+        for i in range(5):
+            Blog.create(title='x%s' % i)
+        Blog.create(title='x2')
+
+        class TestForm(WTForm):
+            blog = RemoteModelSelectField(model=Blog, get_label='title', search_url='/blogs/', per_page=3)
+
+        form = TestForm(obj=self.entry_b1)
+        self.assertEqual(list(form.blog.iter_choices()), [(self.blog_b.id, 'b', True)])
+        self.assertEqual(
+            form.blog(),
+            u'<select data-role="remote" data-url="/blogs/" id="blog" name="blog">'
+            u'<option selected value="%s">b</option></select>' % self.blog_b.id)
+
+        # keyset pagination over (title, pk), including duplicate titles.
+        pages = []
+        cursor = None
+        while True:
+            page = form.blog.search('x', cursor)
+            pages.append([r['text'] for r in page['results']])
+            cursor = page['cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [['x0', 'x1', 'x2'], ['x2', 'x3', 'x4']])
+        self.assertEqual(form.blog.search('x', limit=10)['cursor'], None)
+        self.assertEqual([r['text'] for r in form.blog.search()['results']], ['a', 'b', 'x0'])
+        self.assertRaises(ValueError, form.blog.search, 'x', 'garbage!')
+        for values in (5, [], ['x2'], {'a': 1}, [['x2'], 1], ['x2', 1, 2]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+            self.assertRaises(ValueError, form.blog.search, 'x', cursor)
+
+        # NULL labels are paged through as well.
+        for c in (None, 'b', None, 'a', 'c'):
+            NullFieldsModel.create(c=c)
+        field = RemoteModelSelectField(model=NullFieldsModel, search_fields='c', per_page=2).bind(WTForm(), 'n')
+        pages = []
+        cursor = None
+        while True:
+            page = field.search(None, cursor)
+            pages.append([r['id'] for r in page['results']])
+            cursor = page['cursor']
+            if cursor is None:
+                break
+        ids = [obj.id for obj in NullFieldsModel.select().order_by(NullFieldsModel.id)]
+        self.assertEqual(pages, [[ids[0], ids[2]], [ids[3], ids[1]], [ids[4]]])
+
+        # without search fields a search term could not be used.
+        unbound = RemoteModelSelectField(model=Blog)
+        self.assertRaises(ValueError, unbound.bind, WTForm(), 'blog')
+
+        form = TestForm(FakePost({'blog': self.blog_a.id}))
+        with QueryLog() as log:
+            self.assertTrue(form.validate())
+        self.assertEqual(len(log), 1)
+        self.assertEqual(form.blog.data, self.blog_a)
+
+        form = TestForm(FakePost({'blog': 10000}))
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {'blog': ['Not a valid choice']})
+
+        form = TestForm(FakePost({'blog': ''}))
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {'blog': ['Selection cannot be blank']})
+
+    def test_query_field_validation_queries(self):
+        class TestForm(WTForm):
+            blog = SelectQueryField(query=Blog.select())
+            hidden = HiddenQueryField(query=Blog.select())
+
+        form = TestForm(FakePost({'blog': self.blog_a.id, 'hidden': self.blog_b.id}))
+        with QueryLog() as log:
+            self.assertTrue(form.validate())
+            form.hidden()
+            entry = Entry()
+            form.populate_obj(entry)
+        self.assertEqual(len(log), 2)
+        self.assertEqual(form.blog.data, self.blog_a)
+        self.assertEqual(form.hidden.data, self.blog_b)
+
+        # instances which did not come from the field's query are checked.
+        form = TestForm(data={'blog': self.blog_a, 'hidden': self.blog_b})
+        with QueryLog() as log:
+            self.assertTrue(form.validate())
+        self.assertEqual(len(log), 1)
+
+        class RestrictedForm(WTForm):
+            blog = SelectQueryField(query=Blog.select().where(Blog.title == 'a'))
+            hidden = HiddenQueryField(query=Blog.select().where(Blog.title == 'a'))
+
+        form = RestrictedForm(FakePost({'blog': self.blog_b.id, 'hidden': self.blog_b.id}))
+        with QueryLog() as log:
+            self.assertFalse(form.validate())
+        self.assertEqual(len(log), 2)
+        self.assertEqual(form.errors, {
+            'blog': ['Not a valid choice'],
+            'hidden': ['Not a valid choice']})
+
+        form = RestrictedForm(FakePost({'blog': 'garbage', 'hidden': ''}))
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {'blog': ['Not a valid choice']})
+
+        # unknown pks, or pks outside the query, are not silently dropped.
+        class MultipleForm(WTForm):
+            blogs = SelectMultipleQueryField(query=Blog.select().where(Blog.title == 'a'))
+
+        for pks in ([self.blog_a.id, self.blog_b.id], [self.blog_a.id, 999]):
+            form = MultipleForm(FakePost({'blogs': pks}))
+            with QueryLog() as log:
+                self.assertFalse(form.validate())
+            self.assertEqual(len(log), 1)
+            self.assertEqual(form.errors, {'blogs': ['Not a valid choice']})
+        self.assertTrue(MultipleForm(FakePost({'blogs': [self.blog_a.id]})).validate())
+
+    def test_batch_resolve(self):
+        class TestForm(BatchResolveForm):
+            blog = SelectQueryField(query=Blog.select())
+            hidden = HiddenQueryField(query=Blog.select())
+            blogs = SelectMultipleQueryField(query=Blog.select())
+            restricted = SelectQueryField(query=Blog.select().where(Blog.title == 'a'))
+
+        form = TestForm(FakePost({
+            'blog': self.blog_a.id,
+            'hidden': self.blog_b.id,
+            'blogs': [self.blog_a.id, self.blog_b.id],
+            'restricted': self.blog_b.id}))
+        with QueryLog() as log:
+            self.assertFalse(form.validate())
+            entry = Entry()
+            form.populate_obj(entry)
+        # one query for the three fields sharing a query, one for restricted.
+        self.assertEqual(len(log), 2)
+        self.assertEqual(form.errors, {'restricted': ['Not a valid choice']})
+        self.assertEqual(form.blog.data, self.blog_a)
+        self.assertEqual(form.hidden.data, self.blog_b)
+        self.assertEqual(form.blogs.data, [self.blog_a, self.blog_b])
+
+        form = TestForm(FakePost({
+            'blog': self.blog_a.id, 'restricted': self.blog_a.id,
+            'blogs': [self.blog_a.id, 999]}))
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {'blogs': ['Not a valid choice']})
+
+        form = TestForm(FakePost({'blog': 'garbage', 'hidden': 999, 'blogs': []}))
+        with QueryLog() as log:
+            self.assertFalse(form.validate())
+        self.assertEqual(len(log), 1)
+        self.assertEqual(form.errors, {
+            'blog': ['Not a valid choice'],
+            'hidden': ['Not a valid choice'],
+            'restricted': ['Selection cannot be blank']})
+
+        EntryForm = model_form(Entry, batch_resolve=True, compiled=True)
+        form = EntryForm(FakePost({
+            'blog': self.blog_b.id, 'title': 'x', 'content': 'y',
+            'pub_date-date': '2011-01-01', 'pub_date-time': '00:00:00'}))
+        with QueryLog() as log:
+            self.assertTrue(form.validate())
+        self.assertEqual(len(log), 1)
+        self.assertEqual(form.blog.data, self.blog_b)
+
+    def test_identity_map(self):
+        class TestForm(WTForm):
+            blog = SelectQueryField(query=Blog.select())
+            hidden = HiddenQueryField(query=Blog.select())
+            restricted = SelectQueryField(query=Blog.select().where(Blog.title == 'a'))
+            blogs = SelectMultipleQueryField(query=Blog.select())
+
+        post = FakePost({
+            'blog': self.blog_a.id,
+            'hidden': self.blog_a.id,
+            'restricted': self.blog_b.id,
+            'blogs': [self.blog_a.id, self.blog_b.id]})
+
+        with QueryLog() as log:
+            with IdentityMap() as identity_map:
+                form = TestForm(post)
+                self.assertFalse(form.validate())
+                other = TestForm(post)
+                self.assertFalse(other.validate())
+        # blog a, the restricted lookup of blog b and then blog b itself.
+        self.assertEqual(len(log), 3)
+        self.assertEqual(len(identity_map), 2)
+        self.assertEqual(form.errors, {'restricted': ['Not a valid choice']})
+        self.assertEqual(other.errors, form.errors)
+        self.assertTrue(form.blog.data is form.hidden.data)
+        self.assertTrue(other.blog.data is form.blog.data)
+        self.assertEqual(form.blogs.data, [self.blog_a, self.blog_b])
+        self.assertTrue(form.blogs.data[0] is form.blog.data)
+
+        # without an active map every field queries on its own.
+        with QueryLog() as log:
+            form = TestForm(post)
+            self.assertFalse(form.validate())
+        self.assertEqual(len(log), 4)
+        self.assertFalse(form.blog.data is form.hidden.data)
+
+        # partially loaded instances are not shared with full-row queries.
+        class ProjectedForm(WTForm):
+            ids = SelectQueryField(query=Blog.select(Blog.id))
+            blog = SelectQueryField(query=Blog.select(), get_label='title')
+
+        post = FakePost({'ids': self.blog_a.id, 'blog': self.blog_a.id})
+        with IdentityMap() as identity_map:
+            form = ProjectedForm(post)
+            self.assertEqual(form.ids.data.title, None)
+            self.assertEqual(form.blog.data.title, 'a')
+            self.assertTrue(form.validate())
+            self.assertEqual(list(ProjectedForm(post).blog.iter_choices())[0], (self.blog_a.id, 'a', True))
+        self.assertEqual(len(identity_map), 1)
+        self.assertFalse(form.ids.data is form.blog.data)
+
+    def test_pk_only_fields(self):
+        class TestForm(WTForm):
+            blog = ModelSelectField(model=Blog, pk_only=True, label_columns='title')
+            hidden = ModelHiddenField(model=Blog, pk_only=True)
+            unchecked = ModelHiddenField(model=Blog, pk_only=True, check_exists=False)
+
+        post = FakePost({'blog': str(self.blog_b.id), 'hidden': str(self.blog_a.id),
+                         'unchecked': '1000'})
+        form = TestForm(post)
+        with QueryLog() as log:
+            self.assertEqual(form.hidden(), '<input id="hidden" name="hidden" type="hidden" value="%s">' % self.blog_a.id)
+            self.assertEqual(form.blog.data, self.blog_b.id)
+            entry = Entry()
+            form.populate_obj(entry)
+        self.assertEqual(len(log), 0)
+        self.assertEqual(entry._data['blog'], self.blog_b.id)
+        self.assertEqual(entry.hidden, self.blog_a.id)
+
+        # one cheap existence check per checked field.
+        with QueryLog() as log:
+            self.assertTrue(form.validate())
+        self.assertEqual(len(log), 2)
+        self.assertTrue(all('"title"' not in sql for sql, _ in log.queries))
+
+        self.assertEqual(list(form.blog.iter_choices()), [
+            (self.blog_a.id, 'a', False),
+            (self.blog_b.id, 'b', True)])
+
+        form = TestForm(FakePost({'blog': '1000', 'hidden': 'garbage', 'unchecked': ''}))
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {
+            'blog': ['Not a valid choice'],
+            'hidden': ['Not a valid choice']})
+
+        # instances passed in as data are reduced to their primary key.
+        form = TestForm(data={'blog': self.blog_a, 'hidden': self.blog_b})
+        self.assertEqual(form.blog.data, self.blog_a.id)
+        self.assertEqual(form.hidden._value(), self.blog_b.id)
+
+        # editing an instance does not load its related rows.
+        class EditForm(PkOnlyForm):
+            blog = ModelHiddenField(model=Blog, pk_only=True)
+            title = wtfields.TextField()
+
+        PkOnlyEntryForm = model_form(Entry, field_args={'blog': {'pk_only': True}})
+        for form_class in (EditForm, PkOnlyEntryForm):
+            entry = Entry.get(Entry.pk == self.entry_b1.pk)
+            with QueryLog() as log:
+                form = form_class(obj=entry)
+                if form_class is EditForm:
+                    form.blog()
+            self.assertEqual(len(log), 0)
+            self.assertEqual(form.blog.data, self.blog_b.id)
+            self.assertEqual(form.title.data, 'b1')
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'async def requires Python 3.5')
+    def test_async_validation(self):
+        import asyncio
+        from wtfpeewee.aio import AsyncForm
+        from wtfpeewee.aio import SyncAdapter
+
+        def run(coroutine):
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(coroutine)
+            finally:
+                loop.close()
+
+        class TestForm(AsyncForm):
+            blog = SelectQueryField(query=Blog.select())
+            hidden = HiddenQueryField(query=Blog.select())
+            entries = SelectMultipleQueryField(query=Entry.select(), label_columns='title')
+            restricted = SelectQueryField(query=Blog.select().where(Blog.title == 'a'))
+            pk_only = ModelHiddenField(model=Blog, pk_only=True)
+
+        adapter = SyncAdapter()
+        form = TestForm(FakePost({
+            'blog': self.blog_a.id,
+            'hidden': self.blog_b.id,
+            'entries': [self.entry_a1.pk, self.entry_b1.pk],
+            'restricted': self.blog_b.id,
+            'pk_only': self.blog_a.id}))
+        with QueryLog() as log:
+            self.assertFalse(run(form.validate_async(adapter)))
+        # blogs, entries, the restricted lookup and the pk_only check.
+        self.assertEqual(len(log), 4)
+        self.assertEqual(adapter.peak, 4)
+        self.assertEqual(form.errors, {'restricted': ['Not a valid choice']})
+        self.assertEqual(form.hidden.data, self.blog_b)
+        self.assertEqual(form.entries.data, [self.entry_a1, self.entry_b1])
+
+        # instances passed in as data are checked against the query.
+        form = TestForm(data={'blog': self.blog_b, 'restricted': self.blog_b,
+                              'entries': [self.entry_a2], 'pk_only': 1000})
+        with QueryLog() as log:
+            self.assertFalse(run(form.validate_async(adapter)))
+        # blog and pk_only share a query.
+        self.assertEqual(len(log), 3)
+        self.assertEqual(form.errors, {
+            'restricted': ['Not a valid choice'],
+            'pk_only': ['Not a valid choice']})
+
+        TestForm.adapter = adapter
+        form = TestForm(obj=Entry(blog=self.blog_b, restricted=self.blog_a))
+        with QueryLog() as log:
+            run(form.preload_choices())
+            form.blog()
+            form.entries()
+            form.restricted()
+        self.assertEqual(len(log), 3)
+        self.assertEqual([label for _, label, _ in form.entries.iter_choices()], ['a1', 'a2', 'b1'])
+        self.assertEqual(list(form.blog.iter_choices()), [
+            (self.blog_a.id, 'a', False),
+            (self.blog_b.id, 'b', True)])
+
+    def test_projected_choices(self):
+        class TestForm(WTForm):
+            entry = ModelSelectField(model=Entry, label_columns=['title'])
+            formatted = SelectQueryField(
+                query=Entry.select().order_by(Entry.title.desc()),
+                label_columns=[Entry.title, fn.UPPER(Entry.content)],
+                format_label=lambda title, content: '%s (%s)' % (title, content))
+            blogs = SelectMultipleQueryField(query=Blog.select(), label_columns='title')
+
+        form = TestForm(obj=Entry(entry=self.entry_a2, blogs=[self.blog_b]))
+        with QueryLog() as log:
+            self.assertEqual(list(form.entry.iter_choices()), [
+                (self.entry_a1.pk, 'a1', False),
+                (self.entry_a2.pk, 'a2', True),
+                (self.entry_b1.pk, 'b1', False)])
+        self.assertEqual(len(log), 1)
+        sql = log.queries[0][0]
+        self.assertTrue('"title"' in sql)
+        self.assertFalse('"content"' in sql)
+        self.assertFalse('"pub_date"' in sql)
+
+        self.assertEqual([label for _, label, _ in form.formatted.iter_choices()], [
+            'b1 (B1 CONTENT)', 'a2 (A2 CONTENT)', 'a1 (A1 CONTENT)'])
+        self.assertEqual(list(form.blogs.iter_choices()), [
+            (self.blog_a.id, 'a', False), (self.blog_b.id, 'b', True)])
+
+        # projected choices can also be cached.
+        cache = ChoiceCache()
+
+        class CachedForm(WTForm):
+            entry = ModelSelectField(model=Entry, label_columns=['title'], choice_cache=cache)
+            plain = ModelSelectField(model=Entry, choice_cache=cache)
+            upper = SelectQueryField(
+                query=Blog.select(), label_columns=[fn.Upper(Blog.title)], choice_cache=cache)
+
+        form = CachedForm()
+        list(form.entry.iter_choices())
+        self.assertEqual([label for _, label, _ in form.upper.iter_choices()], ['A', 'B'])
+        with QueryLog() as log:
+            list(CachedForm().entry.iter_choices())
+            self.assertEqual([label for _, label, _ in CachedForm().upper.iter_choices()], ['A', 'B'])
+        self.assertEqual(len(log), 0)
+        self.assertEqual(
+            [label for _, label, _ in form.plain.iter_choices()],
+            ['a: a1', 'a: a2', 'b: b1'])
+
     def test_choices(self):
         form = ChoicesForm()
         self.assertTrue(isinstance(form.gender, SelectChoicesField))
@@ -205,6 +1336,78 @@ class WTFPeeweeTestCase(unittest.TestCase):
         self.assertEqual(form.status.data, None)
         self.assertTrue(form.validate())
 
+    def test_choice_index(self):
+        calls = []
+
+        def coerce(value):
+            calls.append(value)
+            return int(value)
+
+        class TestForm(WTForm):
+            code = SelectChoicesField(
+                coerce=coerce, choices=[(str(i), 'c%d' % i) for i in range(1000)])
+
+        form = TestForm(FakePost({'code': ['500']}))
+        self.assertEqual(form.code.data, 500)
+        del calls[:]
+        selected = [v for v, _, s in form.code.iter_choices() if s]
+        self.assertEqual(selected, ['500'])
+        self.assertEqual(len(calls), 1000)
+
+        # the index is shared by every form instance.
+        del calls[:]
+        for i in range(3):
+            other = TestForm(FakePost({'code': ['7']}))
+            self.assertEqual([v for v, _, s in other.code.iter_choices() if s], ['7'])
+            self.assertFalse(other.validate())
+        self.assertEqual(calls, ['7', '7', '7'])
+
+        # pre_validate compares against the raw values, as wtforms does.
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {'code': ['Not a valid choice']})
+        form.code.choices = [(500, 'five hundred')]
+        self.assertTrue(form.validate())
+        self.assertEqual(list(form.code.iter_choices()), [(500, 'five hundred', True)])
+
+        # in-place changes to the list are picked up as well.
+        form.code.choices.append((501, 'five hundred and one'))
+        form.code.data = 501
+        self.assertTrue(form.validate())
+
+        # so is replacing a choice in place, for every later form.
+        class LetterForm(WTForm):
+            letter = SelectChoicesField(choices=[('a', 'A'), ('b', 'B')])
+
+        form = LetterForm(FakePost({'letter': 'b'}))
+        self.assertTrue(form.validate())
+        form.letter.choices[1] = ('z', 'Z')
+        for letter, valid in (('b', False), ('z', True)):
+            form = LetterForm(FakePost({'letter': letter}))
+            self.assertEqual(form.validate(), valid)
+        form = LetterForm(data={'letter': 'b'})
+        self.assertEqual([s for _, _, s in form.letter.iter_choices()], [False, False])
+
+        form = TestForm(FakePost({'code': ['1000']}))
+        self.assertFalse(form.validate())
+        self.assertEqual([s for _, _, s in form.code.iter_choices() if s], [])
+
+        # converted model fields are indexed when the form class is built.
+        del calls[:]
+        CountingForm = model_form(
+            ChoicesModel, converter=ModelConverter(additional_coerce={IntegerField: coerce}))
+        self.assertEqual(calls, [1, 2])
+        for i in range(3):
+            list(CountingForm().status.iter_choices())
+        self.assertEqual(calls, [1, 2])
+
+        # values which cannot be hashed are compared one by one.
+        class ListForm(WTForm):
+            pair = SelectChoicesField(coerce=tuple, choices=[([1, 2], 'a'), ([3, 4], 'b')])
+
+        form = ListForm(data={'pair': (1, 2)})
+        self.assertEqual([s for _, _, s in form.pair.iter_choices()], [True, False])
+        self.assertEqual(choice_index(form.pair.choices, tuple)[1:], (None, None))
+
     def test_blog_form(self):
         form = BlogForm()
         self.assertEqual(list(form._fields.keys()), ['title'])
@@ -412,7 +1615,47 @@ class WTFPeeweeTestCase(unittest.TestCase):
 
         bad_id = [x for x in range(1,4) if x not in [self.blog_a.id, self.blog_b.id]][0]
         frm = TestForm(FakePost({'blog': [self.blog_b.id, bad_id]}))
+        self.assertFalse(frm.validate())
+        self.assertEqual(frm.errors, {'blog': ['Not a valid choice']})
+
+    def test_form_multiple_queries(self):
+        class TestForm(WTForm):
+            blog = SelectMultipleQueryField(query=Blog.select())
+
+        frm = TestForm(FakePost({'blog': [str(self.blog_b.id), str(self.blog_a.id), str(self.blog_b.id)]}))
+        with QueryLog() as log:
+            self.assertTrue(frm.validate())
+        self.assertEqual(len(log), 1)
+        self.assertEqual(frm.blog.data, [self.blog_a, self.blog_b])
+
+        with QueryLog() as log:
+            self.assertEqual(list(frm.blog.iter_choices()), [
+                (self.blog_a.id, 'a', True),
+                (self.blog_b.id, 'b', True),
+            ])
+        self.assertEqual(len(log), 1)
+
+        frm = TestForm(FakePost({'blog': ['x']}))
+        self.assertFalse(frm.validate())
+        self.assertEqual(frm.errors, {'blog': ['Invalid choice(s): one or more data inputs could not be coerced']})
+
+        # instances which did not come from the field's query are checked.
+        frm = TestForm(data={'blog': [self.blog_a]})
+        with QueryLog() as log:
+            self.assertTrue(frm.validate())
+        self.assertEqual(len(log), 1)
+
+        # primary keys are coerced using the model's primary key field.
+        NonIntPKModel.create(id='k1', value='v1')
+        NonIntPKModel.create(id='k2', value='v2')
+
+        class NonIntForm(WTForm):
+            objs = SelectMultipleQueryField(query=NonIntPKModel.select(), get_label='value')
+
+        frm = NonIntForm(FakePost({'objs': ['k2']}))
         self.assertTrue(frm.validate())
+        self.assertEqual([o.id for o in frm.objs.data], ['k2'])
+        self.assertEqual(list(frm.objs.iter_choices()), [('k1', 'v1', False), ('k2', 'v2', True)])
 
     def test_hidden_field(self):
         class TestEntryForm(WTForm):
@@ -0,0 +1,140 @@
+"""
+Per-field lifecycle timing for wtforms and wtfpeewee fields.
+
+    from wtfpeewee.timing import FieldTimer
+
+    with FieldTimer() as timer:
+        form = EntryForm(request.form)
+        form.validate()
+        html = form.blog()
+
+    for (name, phase), elapsed in timer.timings.items():
+        ...
+
+While at least one timer is active, the lifecycle methods of every ``Field``
+subclass are wrapped; the original methods are restored when the last timer
+exits, so there is no overhead when timing is disabled. Timers only receive
+measurements taken in the thread which activated them.
+"""
+import functools
+import threading
+from timeit import default_timer
+
+from wtforms.fields import Field
+
+
+__all__ = (
+    'FieldTimer',
+    'PHASES',
+)
+
+# Field method name -> reported phase.
+PHASES = (
+    ('process', 'process'),
+    ('process_formdata', 'process_formdata'),
+    ('pre_validate', 'pre_validate'),
+    ('_run_validation_chain', 'validators'),
+    ('__call__', 'render'),
+    ('populate_obj', 'populate_obj'),
+)
+
+_local = threading.local()
+_lock = threading.Lock()
+_patched = []
+_active_count = [0]
+
+
+def _wrap(method, phase):
+    @functools.wraps(method)
+    def inner(self, *args, **kwargs):
+        timers = getattr(_local, 'timers', None)
+        if not timers:
+            return method(self, *args, **kwargs)
+
+        # Overridden methods usually call their parent implementation, only
+        # report the outermost call for a given field and phase.
+        key = (id(self), phase)
+        running = _local.running
+        if key in running:
+            return method(self, *args, **kwargs)
+
+        running.add(key)
+        start = default_timer()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            elapsed = default_timer() - start
+            running.discard(key)
+            for timer in list(timers):
+                timer.record(self, phase, elapsed)
+    inner._wtfpeewee_timed = True
+    return inner
+
+
+def _field_classes():
+    seen = set()
+    stack = [Field]
+    while stack:
+        klass = stack.pop()
+        if klass in seen:
+            continue
+        seen.add(klass)
+        yield klass
+        stack.extend(klass.__subclasses__())
+
+
+def _patch():
+    for klass in _field_classes():
+        for method_name, phase in PHASES:
+            method = klass.__dict__.get(method_name)
+            if method is None or getattr(method, '_wtfpeewee_timed', False):
+                continue
+            if isinstance(method, (staticmethod, classmethod)):
+                continue
+            setattr(klass, method_name, _wrap(method, phase))
+            _patched.append((klass, method_name, method))
+
+
+def _unpatch():
+    while _patched:
+        klass, method_name, method = _patched.pop()
+        setattr(klass, method_name, method)
+
+
+class FieldTimer(object):
+    """
+    Context manager which collects the wall time spent by each field in each
+    lifecycle phase: ``process``, ``process_formdata``, ``pre_validate``,
+    ``validators``, ``render`` and ``populate_obj``.
+
+    Totals are accumulated in `timings`, a dictionary keyed by
+    ``(field name, phase)``. If `callback` is given, it is also called with
+    ``(field, phase, elapsed)`` for every measurement.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timings = {}
+
+    def record(self, field, phase, elapsed):
+        key = (field.name, phase)
+        self.timings[key] = self.timings.get(key, 0.) + elapsed
+        if self.callback is not None:
+            self.callback(field, phase, elapsed)
+
+    def __enter__(self):
+        with _lock:
+            if _active_count[0] == 0:
+                _patch()
+            _active_count[0] += 1
+        if getattr(_local, 'timers', None) is None:
+            _local.timers = []
+            _local.running = set()
+        _local.timers.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.timers.remove(self)
+        with _lock:
+            _active_count[0] -= 1
+            if _active_count[0] == 0:
+                _unpatch()